@@ -0,0 +1,180 @@
+"""Análisis de URLs independiente de la API (usado por main.py y bulk_scan.py)"""
+import hashlib
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse, urlunparse
+
+from shared_cache import SharedVerdictCache
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def canonicalize_url(url: str) -> Optional[str]:
+    """Normaliza una URL para deduplicar: esquema/host en minúsculas, sin
+    puerto por defecto ni fragmento. Devuelve None si no es una URL válida."""
+    url = url.strip()
+    if not url:
+        return None
+    if "://" not in url:
+        url = "http://" + url
+    try:
+        parsed = urlparse(url)
+        port = parsed.port
+    except ValueError:
+        return None
+    scheme = parsed.scheme.lower()
+    host = (parsed.hostname or "").rstrip(".")
+    if scheme not in _DEFAULT_PORTS or not host:
+        return None
+    if ":" in host:
+        host = f"[{host}]"
+    netloc = host if port in (None, _DEFAULT_PORTS[scheme]) else f"{host}:{port}"
+    if parsed.username:
+        userinfo = parsed.username + (f":{parsed.password}" if parsed.password else "")
+        netloc = f"{userinfo}@{netloc}"
+    return urlunparse((scheme, netloc, parsed.path or "/", parsed.params, parsed.query, ""))
+
+
+def normalize_url(url: str) -> str:
+    """URL que se analiza y se guarda: la canónica, o la original si no se puede
+    normalizar. La API y bulk_scan.py la usan igual para que una misma URL
+    reciba el mismo veredicto por ambas rutas."""
+    return canonicalize_url(url) or url
+
+
+def url_hash(url: str) -> str:
+    """Clave de url_analysis: sha256 de ``normalize_url(url)``"""
+    return hashlib.sha256(normalize_url(url).encode()).hexdigest()
+
+
+class PhishingAnalyzer:
+    # Caché de veredictos/reputación; la API la asigna al arrancar cada worker
+    cache: Optional[SharedVerdictCache] = None
+    cache_ttl: float = 3600.0
+
+    # Umbrales y léxico; configure() los sobrescribe con system_config
+    phishing_threshold: float = 0.85
+    suspicious_threshold: float = 0.60
+    suspicious_words: List[str] = ['login', 'verify', 'account', 'bank', 'paypal', 'secure']
+
+    @staticmethod
+    def configure(config: Dict[str, Any]):
+        """Aplica la configuración de system_config (config_key -> config_value)"""
+        if "phishing_threshold" in config:
+            PhishingAnalyzer.phishing_threshold = float(config["phishing_threshold"]["value"])
+        if "suspicious_threshold" in config:
+            PhishingAnalyzer.suspicious_threshold = float(config["suspicious_threshold"]["value"])
+        if "suspicious_words" in config:
+            PhishingAnalyzer.suspicious_words = [w.lower() for w in config["suspicious_words"]["words"]]
+
+    @staticmethod
+    def analyze_url(url: str) -> Dict[str, Any]:
+        """Simula análisis de phishing - En producción conectar con n8n"""
+        cache = PhishingAnalyzer.cache
+        if cache is not None:
+            cached = cache.get("verdict", url)
+            if cached is not None:
+                return cached
+
+        # Esta función se integraría con el workflow de n8n
+        features = PhishingAnalyzer.extract_features(url)
+        
+        # Simulación de modelo ML
+        risk_score = PhishingAnalyzer.calculate_risk_score(features)
+        
+        # Clasificación
+        if risk_score >= PhishingAnalyzer.phishing_threshold:
+            prediction = "PHISHING"
+            risk_level = "HIGH"
+        elif risk_score >= PhishingAnalyzer.suspicious_threshold:
+            prediction = "SUSPICIOUS" 
+            risk_level = "MEDIUM"
+        else:
+            prediction = "LEGITIMATE"
+            risk_level = "LOW"
+        
+        result = {
+            "prediction": prediction,
+            "risk_level": risk_level,
+            "probability": round(risk_score, 4),
+            "confidence": "HIGH" if risk_score > 0.9 or risk_score < 0.1 else "MEDIUM",
+            "features_extracted": len(features),
+            "feature_summary": {
+                "url_length": features.get('url_length', 0),
+                "suspicious_keywords": features.get('suspicious_words_count', 0),
+                "entropy_score": round(features.get('url_entropy', 0), 2)
+            },
+            "threat_intelligence": PhishingAnalyzer.check_reputation(url)
+        }
+
+        if cache is not None:
+            cache.set("verdict", url, result, PhishingAnalyzer.cache_ttl)
+        return result
+
+    @staticmethod
+    def check_reputation(url: str) -> Dict[str, Any]:
+        """Consulta reputación del dominio (cacheada por dominio entre workers)"""
+        domain = urlparse(url).netloc.lower()
+        cache = PhishingAnalyzer.cache
+        if cache is not None:
+            cached = cache.get("reputation", domain)
+            if cached is not None:
+                return cached
+
+        reputation = {
+            "virustotal": {"status": "checked", "malicious": 0},
+            "google_safe_browsing": {"status": "checked", "threats": []}
+        }
+
+        if cache is not None:
+            cache.set("reputation", domain, reputation, PhishingAnalyzer.cache_ttl)
+        return reputation
+    
+    @staticmethod
+    def extract_features(url: str) -> Dict[str, Any]:
+        """Extrae características de la URL"""
+        import re
+        
+        features = {}
+        parsed = urlparse(url)
+        
+        # Características básicas
+        features['url_length'] = len(url)
+        features['num_dots'] = url.count('.')
+        features['num_hyphens'] = url.count('-')
+        features['num_slashes'] = url.count('/')
+        
+        # Palabras sospechosas
+        lowered = url.lower()
+        features['suspicious_words_count'] = sum(1 for word in PhishingAnalyzer.suspicious_words if word in lowered)
+        
+        # Entropía (simulada)
+        features['url_entropy'] = len(set(url)) / len(url) if url else 0
+        
+        return features
+    
+    @staticmethod
+    def calculate_risk_score(features: Dict[str, Any]) -> float:
+        """Calcula puntuación de riesgo"""
+        score = 0.0
+        score += min(features.get('url_length', 0) / 100, 0.3)
+        score += min(features.get('suspicious_words_count', 0) * 0.2, 0.4)
+        score += features.get('url_entropy', 0) * 0.3
+        return min(score, 1.0)
+
+
+def build_analysis_record(url: str, analysis_result: Dict[str, Any], created_by: str,
+                          processing_time: float = 0.5) -> Dict[str, Any]:
+    """Construye la fila de url_analysis para un análisis"""
+    return {
+        "url": url,
+        "url_hash": url_hash(url),
+        "analysis_result": analysis_result,
+        "risk_level": analysis_result["risk_level"],
+        "prediction": analysis_result["prediction"],
+        "probability": analysis_result["probability"],
+        "confidence": analysis_result["confidence"],
+        "features_extracted": analysis_result["features_extracted"],
+        "processing_time": processing_time,
+        "threat_intelligence": analysis_result.get("threat_intelligence", {}),
+        "created_by": created_by
+    }
@@ -0,0 +1,70 @@
+"""Benchmark de arranque en frío: tiempo de import y tiempo hasta /ready.
+
+Uso:
+    python bench_startup.py [--runs 5] [--port 8765]
+
+Cada ejecución usa un proceso nuevo para medir el arranque real de un pod.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def measure_import() -> float:
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=BACKEND_DIR)
+    return float(output.decode().strip().splitlines()[-1])
+
+
+def measure_ready(port: int, timeout: float) -> dict:
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/ready", timeout=1) as response:
+                    state = json.loads(response.read())
+                    state["time_to_ready"] = time.perf_counter() - started
+                    return state
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.02)
+        raise TimeoutError(f"/ready no respondió 200 en {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def summarize(label: str, values: list):
+    print(f"{label:<16} media={statistics.mean(values) * 1000:8.1f} ms  "
+          f"min={min(values) * 1000:8.1f} ms  max={max(values) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de arranque de la API")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.runs)]
+    readiness = [measure_ready(args.port, args.timeout) for _ in range(args.runs)]
+
+    summarize("import", imports)
+    summarize("time-to-ready", [r["time_to_ready"] for r in readiness])
+    for step in readiness[0]["steps"]:
+        summarize(f"  {step}", [r["steps"][step] for r in readiness])
+
+
+if __name__ == "__main__":
+    main()
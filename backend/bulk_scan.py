@@ -0,0 +1,425 @@
+"""Escáner masivo offline de URLs (retro-hunting sobre logs de proxy).
+
+Lee URLs de archivos o stdin (texto plano o .gz), las normaliza, deduplica y
+analiza en paralelo con ``PhishingAnalyzer`` usando todos los núcleos. Los
+resultados se escriben en CSV o Parquet y, opcionalmente, se cargan en
+``url_analysis`` con ``COPY`` sobre una tabla temporal.
+
+Las URLs se analizan y guardan en su forma canónica, igual que en la API
+(``analyzer.normalize_url``): ambas rutas dan el mismo veredicto y actualizan
+la misma fila.
+La memoria está acotada: la deduplicación usa una tabla de tamaño fijo
+(``--dedupe-memory-mb``) y sólo hay ``--max-inflight`` bloques en vuelo.
+
+Los umbrales y el léxico se leen de ``system_config`` una vez al empezar (por
+``--dsn`` o, si no, por SUPABASE_URL/SUPABASE_KEY) y se aplican en cada worker,
+para que los veredictos coincidan con los de la API.
+
+Ejemplos:
+    python bulk_scan.py proxy-2024-05-01.log.gz -o resultados.parquet
+    zcat logs/*.gz | python bulk_scan.py - -o resultados.csv --copy
+"""
+import argparse
+import asyncio
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+from array import array
+from datetime import datetime, timezone
+from decimal import Decimal
+from multiprocessing import Pool
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from analyzer import PhishingAnalyzer, build_analysis_record, canonicalize_url
+
+COLUMNS = [
+    "url", "url_hash", "prediction", "risk_level", "probability", "confidence",
+    "features_extracted", "processing_time", "analysis_result",
+    "threat_intelligence", "created_by", "created_at",
+]
+JSON_COLUMNS = ("analysis_result", "threat_intelligence")
+PREDICTION = COLUMNS.index("prediction")
+
+
+# Lectura
+def open_source(path: str) -> io.TextIOBase:
+    """Abre un archivo de entrada; '-' es stdin y .gz se descomprime al vuelo"""
+    if path == "-":
+        raw = sys.stdin.buffer
+        # Detecta gzip por los bytes mágicos también en stdin
+        peek = raw.peek(2)[:2] if hasattr(raw, "peek") else b""
+        if peek == b"\x1f\x8b":
+            return io.TextIOWrapper(gzip.GzipFile(fileobj=raw), encoding="utf-8", errors="replace")
+        return io.TextIOWrapper(raw, encoding="utf-8", errors="replace")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, "r", encoding="utf-8", errors="replace")
+
+
+def read_urls(paths: List[str], column: int) -> Iterator[str]:
+    """Devuelve la URL de cada línea (columna separada por espacios, o la línea entera)"""
+    for path in paths:
+        with open_source(path) as source:
+            for line in source:
+                if column < 0:
+                    yield line
+                    continue
+                fields = line.split()
+                if len(fields) > column:
+                    yield fields[column]
+
+
+class FingerprintSet:
+    """Conjunto de huellas de 64 bits en un array plano de tamaño fijo.
+
+    Ocupa ``max_bytes`` (8 bytes por hueco, direccionamiento abierto) en lugar
+    de ~70 bytes por URL de un ``set`` de Python. Al llenarse se vacía y
+    empieza de nuevo: algún duplicado lejano se vuelve a analizar, lo que es
+    inocuo porque la carga es un upsert por url_hash.
+    """
+
+    MAX_LOAD = 0.7
+
+    def __init__(self, max_bytes: int):
+        self._slots = max(max_bytes // 8, 1024)
+        self._limit = int(self._slots * self.MAX_LOAD)
+        self._table = array("Q", bytes(8 * self._slots))
+        self.size = 0
+        self.resets = 0
+
+    @staticmethod
+    def fingerprint(value: str) -> int:
+        # 0 marca un hueco libre
+        digest = hashlib.blake2b(value.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little") or 1
+
+    def add(self, value: str) -> bool:
+        """Añade ``value``; devuelve False si ya estaba"""
+        fingerprint = self.fingerprint(value)
+        table, slots = self._table, self._slots
+        index = fingerprint % slots
+        while True:
+            current = table[index]
+            if current == fingerprint:
+                return False
+            if current == 0:
+                break
+            index = index + 1 if index + 1 < slots else 0
+        if self.size >= self._limit:
+            self._table = table = array("Q", bytes(8 * slots))
+            self.size = 0
+            self.resets += 1
+            index = fingerprint % slots
+        table[index] = fingerprint
+        self.size += 1
+        return True
+
+
+def unique_urls(urls: Iterable[str], progress: "Progress",
+                seen: Optional[FingerprintSet] = None) -> Iterator[str]:
+    """Normaliza y, si se pasa ``seen``, elimina duplicados"""
+    for raw in urls:
+        progress.read += 1
+        url = canonicalize_url(raw)
+        if url is None:
+            progress.invalid += 1
+            continue
+        if seen is not None and not seen.add(url):
+            continue
+        yield url
+
+
+def bounded(items: Iterable, slots: threading.Semaphore, stop: threading.Event) -> Iterator:
+    """Entrega elementos sólo cuando hay hueco en ``slots`` (lo libera el consumidor).
+
+    ``Pool.imap_unordered`` consume el iterador desde su propio hilo tan rápido
+    como puede; sin este límite leería toda la entrada y acumularía en memoria
+    los bloques pendientes y sus resultados.
+    """
+    for item in items:
+        while not slots.acquire(timeout=0.5):
+            if stop.is_set():
+                return
+        if stop.is_set():
+            return
+        yield item
+
+
+def chunked(items: Iterable[str], size: int) -> Iterator[List[str]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# Configuración
+async def _fetch_config_pg(dsn: str) -> Dict[str, Any]:
+    import asyncpg
+
+    conn = await asyncpg.connect(dsn)
+    try:
+        rows = await conn.fetch("SELECT config_key, config_value FROM system_config")
+    finally:
+        await conn.close()
+    return {row["config_key"]: json.loads(row["config_value"]) for row in rows}
+
+
+def load_config(dsn: Optional[str]) -> Dict[str, Any]:
+    """Lee system_config (config_key -> config_value); {} si no hay origen configurado"""
+    if dsn:
+        return asyncio.run(_fetch_config_pg(dsn))
+    supabase_url, supabase_key = os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY")
+    if supabase_url and supabase_key:
+        from supabase import create_client
+
+        result = create_client(supabase_url, supabase_key).table("system_config").select(
+            "config_key, config_value"
+        ).execute()
+        return {row["config_key"]: row["config_value"] for row in result.data or []}
+    return {}
+
+
+# Análisis (se ejecuta en los procesos del pool)
+def analyze_chunk(args) -> List[tuple]:
+    """Analiza un bloque y devuelve filas en el orden de COLUMNS.
+
+    Los campos JSON se serializan aquí para que el proceso principal sólo
+    reciba cadenas (más baratas de transferir que diccionarios anidados).
+    """
+    urls, created_by = args
+    created_at = datetime.now(timezone.utc)
+    rows = []
+    for url in urls:
+        start = time.perf_counter()
+        analysis_result = PhishingAnalyzer.analyze_url(url)
+        record = build_analysis_record(url, analysis_result, created_by,
+                                       processing_time=round(time.perf_counter() - start, 4))
+        record["created_at"] = created_at
+        for column in JSON_COLUMNS:
+            record[column] = json.dumps(record[column], separators=(",", ":"))
+        rows.append(tuple(record[c] for c in COLUMNS))
+    return rows
+
+
+# Salidas
+class CSVWriter:
+    def __init__(self, path: str):
+        self._file = sys.stdout if path == "-" else open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(COLUMNS)
+
+    def write(self, rows: List[tuple]):
+        self._writer.writerows(rows)
+
+    def close(self):
+        if self._file is not sys.stdout:
+            self._file.close()
+
+
+class ParquetWriter:
+    def __init__(self, path: str):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Se requiere pyarrow para escribir Parquet (pip install pyarrow)")
+        self._pa = pa
+        self._schema = pa.schema([
+            ("url", pa.string()), ("url_hash", pa.string()),
+            ("prediction", pa.string()), ("risk_level", pa.string()),
+            ("probability", pa.float64()), ("confidence", pa.string()),
+            ("features_extracted", pa.int32()), ("processing_time", pa.float64()),
+            ("analysis_result", pa.string()), ("threat_intelligence", pa.string()),
+            ("created_by", pa.string()), ("created_at", pa.timestamp("us", tz="UTC")),
+        ])
+        self._writer = pq.ParquetWriter(path, self._schema, compression="zstd")
+
+    def write(self, rows: List[tuple]):
+        columns = dict(zip(COLUMNS, map(list, zip(*rows))))
+        self._writer.write_table(self._pa.Table.from_pydict(columns, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+class CopyLoader:
+    """Carga en url_analysis con COPY a una tabla temporal + upsert_url_analyses_from()"""
+
+    STAGE_TABLE = "url_analysis_stage"
+    _DECIMALS = (COLUMNS.index("probability"), COLUMNS.index("processing_time"))
+
+    def __init__(self, dsn: str, batch_size: int):
+        import asyncpg
+
+        self._loop = asyncio.new_event_loop()
+        self._conn = self._loop.run_until_complete(asyncpg.connect(dsn))
+        self._loop.run_until_complete(self._conn.execute(
+            f"CREATE TEMP TABLE {self.STAGE_TABLE} "
+            f"(LIKE url_analysis INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+        ))
+        self._batch_size = batch_size
+        self._pending: List[tuple] = []
+        self.loaded = 0
+
+    def write(self, rows: List[tuple]):
+        self._pending.extend(rows)
+        if len(self._pending) >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        self._loop.run_until_complete(self._copy(self._pending))
+        self.loaded += len(self._pending)
+        self._pending = []
+
+    async def _copy(self, rows: List[tuple]):
+        rows = [
+            tuple(Decimal(str(v)) if i in self._DECIMALS else v for i, v in enumerate(row))
+            for row in rows
+        ]
+        async with self._conn.transaction():
+            await self._conn.copy_records_to_table(self.STAGE_TABLE, records=rows, columns=COLUMNS)
+            # Estadísticas de la tabla temporal para que el upsert no planifique a ciegas
+            await self._conn.execute(f"ANALYZE {self.STAGE_TABLE}")
+            # url_hash es único vía url_analysis_index (url_analysis está particionada);
+            # el upsert lee directamente de la tabla de staging, sin pasar por JSONB
+            await self._conn.execute(
+                "SELECT count(*) FROM upsert_url_analyses_from($1::regclass)", self.STAGE_TABLE
+            )
+
+    def close(self):
+        self.flush()
+        self._loop.run_until_complete(self._conn.close())
+        self._loop.close()
+
+
+# Progreso
+class Progress:
+    def __init__(self, interval: float, stream=sys.stderr):
+        self.interval = interval
+        self.stream = stream
+        self.read = 0
+        self.invalid = 0
+        self.analyzed = 0
+        self.high_risk = 0
+        self._start = time.monotonic()
+        self._last = self._start
+
+    def update(self, rows: List[tuple], force: bool = False):
+        self.analyzed += len(rows)
+        self.high_risk += sum(1 for r in rows if r[PREDICTION] != "LEGITIMATE")
+        now = time.monotonic()
+        if force or now - self._last >= self.interval:
+            self._last = now
+            self.report()
+
+    def report(self):
+        elapsed = max(time.monotonic() - self._start, 1e-9)
+        print(
+            f"[{elapsed:8.1f}s] leídas={self.read} inválidas={self.invalid} "
+            f"analizadas={self.analyzed} sospechosas={self.high_risk} "
+            f"{self.analyzed / elapsed:,.0f} URLs/s",
+            file=self.stream, flush=True,
+        )
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Escaneo masivo offline de URLs")
+    parser.add_argument("inputs", nargs="*", default=["-"],
+                        help="Archivos de entrada (.gz soportado); '-' para stdin")
+    parser.add_argument("-o", "--output", help="Archivo de salida (.csv o .parquet); '-' para stdout")
+    parser.add_argument("--format", choices=["csv", "parquet"],
+                        help="Formato de salida (por defecto según la extensión)")
+    parser.add_argument("--column", type=int, default=-1,
+                        help="Columna (separada por espacios) que contiene la URL; -1 = línea entera")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Procesos de análisis (por defecto todos los núcleos)")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="URLs por tarea del pool")
+    parser.add_argument("--no-dedupe", action="store_true", help="No eliminar URLs duplicadas")
+    parser.add_argument("--dedupe-memory-mb", type=int, default=256,
+                        help="Memoria máxima para la deduplicación (al llenarse se reinicia)")
+    parser.add_argument("--max-inflight", type=int,
+                        help="Bloques enviados al pool sin procesar (por defecto 2 por worker)")
+    parser.add_argument("--created-by", default="bulk-scan", help="Valor de created_by")
+    parser.add_argument("--copy", action="store_true",
+                        help="Cargar resultados en url_analysis mediante COPY")
+    parser.add_argument("--dsn", default=os.getenv("DATABASE_URL"),
+                        help="DSN de Postgres para --copy (por defecto $DATABASE_URL)")
+    parser.add_argument("--copy-batch-size", type=int, default=50000, help="Filas por COPY")
+    parser.add_argument("--no-db-config", action="store_true",
+                        help="No leer system_config; usar los umbrales por defecto del analizador")
+    parser.add_argument("--progress-interval", type=float, default=5.0,
+                        help="Segundos entre reportes de throughput")
+    args = parser.parse_args(argv)
+
+    if not args.output and not args.copy:
+        parser.error("indica --output y/o --copy")
+    if args.copy and not args.dsn:
+        parser.error("--copy requiere --dsn o DATABASE_URL")
+    if args.max_inflight is None:
+        args.max_inflight = 2 * args.workers
+    if args.output and not args.format:
+        args.format = "parquet" if args.output.endswith(".parquet") else "csv"
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    progress = Progress(args.progress_interval)
+
+    config: Dict[str, Any] = {}
+    if not args.no_db_config:
+        try:
+            config = load_config(args.dsn)
+        except Exception as e:
+            raise SystemExit(f"No se pudo leer system_config: {e} (usa --no-db-config para omitirla)")
+        if not config:
+            print("Sin DSN ni SUPABASE_URL/SUPABASE_KEY: se usan los umbrales por defecto",
+                  file=sys.stderr, flush=True)
+
+    sinks = []
+    if args.output:
+        sinks.append(ParquetWriter(args.output) if args.format == "parquet" else CSVWriter(args.output))
+    if args.copy:
+        sinks.append(CopyLoader(args.dsn, args.copy_batch_size))
+
+    seen = None if args.no_dedupe else FingerprintSet(args.dedupe_memory_mb * 1024 * 1024)
+    urls = unique_urls(read_urls(args.inputs, args.column), progress, seen)
+    inflight = threading.Semaphore(args.max_inflight)
+    stop = threading.Event()
+    tasks = bounded(((chunk, args.created_by) for chunk in chunked(urls, args.chunk_size)), inflight, stop)
+    try:
+        with Pool(processes=args.workers, initializer=PhishingAnalyzer.configure,
+                  initargs=(config,)) as pool:
+            try:
+                for rows in pool.imap_unordered(analyze_chunk, tasks):
+                    for sink in sinks:
+                        sink.write(rows)
+                    progress.update(rows)
+                    inflight.release()
+            finally:
+                # Desbloquea el hilo del pool si salimos antes de agotar la entrada
+                stop.set()
+    finally:
+        for sink in sinks:
+            sink.close()
+    progress.update([], force=True)
+    if seen is not None and seen.resets:
+        print(f"Deduplicación reiniciada {seen.resets} veces (aumenta --dedupe-memory-mb)",
+              file=sys.stderr, flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+"""Perfilado bajo demanda y captura de peticiones lentas.
+
+- Cada petición acumula un desglose de tiempo por categoría (``span("db")``,
+  ``span("analysis")``...). Se devuelve en la cabecera ``Server-Timing`` sólo a
+  peticiones con un ``X-Admin-Token`` válido: no se expone a cualquier cliente.
+- Se perfila con cProfile una fracción de peticiones (``PROFILE_SAMPLE_RATE``) o
+  las que envían ``X-Profile: 1`` junto con un ``X-Admin-Token`` válido.
+- Las peticiones que superan el umbral de latencia, y las perfiladas, se
+  guardan en un buffer circular que se consulta desde /admin.
+
+Con un directorio (``SLOW_REQUEST_DIR``) el buffer se comparte entre los
+workers de la máquina; sin él cada proceso guarda sólo sus peticiones.
+"""
+import cProfile
+import hmac
+import io
+import json
+import os
+import pstats
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+PROFILE_HEADER = b"x-profile"
+ADMIN_TOKEN_HEADER = b"x-admin-token"
+PROFILE_TOP_FUNCTIONS = 30
+
+
+class RequestProfile:
+    """Tiempos acumulados de una petición, por categoría"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            entry = self.spans.setdefault(name, {"calls": 0, "ms": 0.0})
+            entry["calls"] += 1
+            entry["ms"] += seconds * 1000
+
+    def breakdown(self, total_ms: float) -> Dict[str, Dict[str, float]]:
+        """Desglose por categoría; 'other' es el tiempo no cubierto por ningún span"""
+        with self._lock:
+            result = {name: {"calls": s["calls"], "ms": round(s["ms"], 2)} for name, s in self.spans.items()}
+        accounted = sum(s["ms"] for s in result.values())
+        result["other"] = {"ms": round(max(total_ms - accounted, 0.0), 2)}
+        return result
+
+
+_current: ContextVar[Optional[RequestProfile]] = ContextVar("request_profile", default=None)
+
+
+@contextmanager
+def span(name: str):
+    """Mide un bloque y lo suma a la petición en curso (sin efecto fuera de una petición)"""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - started)
+
+
+class SlowRequestLog:
+    """Buffer circular de peticiones lentas o perfiladas.
+
+    Con ``directory`` cada proceso añade sus entradas a ``<directory>/<pid>.jsonl``
+    (sólo él escribe en ese archivo, así que no hace falta bloqueo entre
+    procesos) y ``entries()`` mezcla los archivos de todos los workers. Cada
+    archivo se recorta a las ``maxlen`` entradas más recientes. Al crearse se
+    borran los archivos de procesos que ya no existen (despliegues anteriores).
+    """
+
+    def __init__(self, maxlen: int, directory: Optional[str] = None):
+        self.maxlen = maxlen
+        self.directory = directory
+        self._entries: deque = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+        self._lines = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            for path in self._files():
+                pid = os.path.basename(path)[:-len(".jsonl")]
+                if not pid.isdigit() or not _pid_alive(int(pid)):
+                    _remove(path)
+
+    def record(self, entry: Dict[str, Any]):
+        entry = {**entry, "pid": os.getpid()}
+        with self._lock:
+            if not self.directory:
+                self._entries.append(entry)
+                return
+            path = os.path.join(self.directory, f"{os.getpid()}.jsonl")
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, default=str) + "\n")
+            self._lines += 1
+            if self._lines > 2 * self.maxlen:
+                self._lines = self._trim(path)
+
+    def entries(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        if not self.directory:
+            with self._lock:
+                items = list(reversed(self._entries))
+        else:
+            items = [entry for path in self._files() for entry in _read_entries(path)]
+            items.sort(key=lambda e: e.get("timestamp") or "", reverse=True)
+            items = items[:self.maxlen]
+        return items[:limit] if limit else items
+
+    def clear(self):
+        """Vacía el buffer; con ``directory``, el de todos los workers"""
+        with self._lock:
+            self._entries.clear()
+            if self.directory:
+                for path in self._files():
+                    _remove(path)
+                self._lines = 0
+
+    def _files(self) -> List[str]:
+        return [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                if name.endswith(".jsonl")]
+
+    def _trim(self, path: str) -> int:
+        """Deja en el archivo las ``maxlen`` últimas líneas; devuelve cuántas quedan"""
+        try:
+            with open(path, encoding="utf-8") as f:
+                lines = f.readlines()[-self.maxlen:]
+        except FileNotFoundError:
+            return 0
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+        os.replace(tmp_path, path)
+        return len(lines)
+
+
+def _read_entries(path: str) -> List[Dict[str, Any]]:
+    entries = []
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                # La última línea puede estar a medio escribir por su worker
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _format_profile(profiler: cProfile.Profile) -> str:
+    output = io.StringIO()
+    stats = pstats.Stats(profiler, stream=output)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_TOP_FUNCTIONS)
+    return output.getvalue()
+
+
+class ProfilingMiddleware:
+    """Middleware ASGI: desglose por petición, muestreo de perfiles y registro de lentas.
+
+    Sólo un perfil cProfile puede estar activo a la vez por proceso; si otra
+    petición ya se está perfilando, ésta registra únicamente el desglose. En
+    un servidor asíncrono el perfil incluye también el trabajo de otras
+    peticiones que se ejecuten en paralelo en el mismo event loop.
+    """
+
+    def __init__(self, app, log: SlowRequestLog, slow_ms: float, sample_rate: float,
+                 admin_token: Optional[str] = None):
+        self.app = app
+        self.log = log
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.admin_token = admin_token.encode() if admin_token else None
+        self._profiler_lock = threading.Lock()
+
+    def _is_admin(self, headers: Dict[bytes, bytes]) -> bool:
+        token = headers.get(ADMIN_TOKEN_HEADER)
+        return self.admin_token is not None and token is not None and hmac.compare_digest(token, self.admin_token)
+
+    def _wants_profile(self, headers: Dict[bytes, bytes], is_admin: bool) -> bool:
+        if headers.get(PROFILE_HEADER, b"").lower() in (b"1", b"true"):
+            return is_admin
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        is_admin = self._is_admin(headers)
+        profile = RequestProfile()
+        token = _current.set(profile)
+        status = 500
+
+        profiler = None
+        if self._wants_profile(headers, is_admin) and self._profiler_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if is_admin:
+                    elapsed_ms = (time.perf_counter() - profile.started) * 1000
+                    timing = ", ".join(
+                        f'{name};dur={s["ms"]:.1f}' for name, s in profile.breakdown(elapsed_ms).items()
+                    )
+                    message["headers"] = list(message.get("headers", [])) + [(b"server-timing", timing.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            call_profile = None
+            if profiler is not None:
+                profiler.disable()
+                self._profiler_lock.release()
+                call_profile = _format_profile(profiler)
+
+            duration_ms = (time.perf_counter() - profile.started) * 1000
+            if duration_ms >= self.slow_ms or call_profile is not None:
+                self.log.record({
+                    "timestamp": datetime.now().isoformat(),
+                    "method": scope.get("method"),
+                    "path": scope.get("path"),
+                    "query": scope.get("query_string", b"").decode(errors="replace"),
+                    "status": status,
+                    "duration_ms": round(duration_ms, 2),
+                    "slow": duration_ms >= self.slow_ms,
+                    "breakdown": profile.breakdown(duration_ms),
+                    "profile": call_profile,
+                })
+            _current.reset(token)
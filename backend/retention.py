@@ -0,0 +1,195 @@
+"""Retención de url_analysis: crea particiones futuras y archiva las antiguas.
+
+Cada pasada:
+1. Ejecuta ensure_url_analysis_partitions() para tener los próximos meses listos.
+   Si falla se informa y la pasada sigue archivando (con código de salida 1):
+   un error creando particiones futuras no debe frenar la retención.
+2. Desvincula (DETACH) las particiones mensuales más antiguas que el periodo
+   de retención y, en la misma transacción, borra sus entradas de
+   url_analysis_index: un reanálisis posterior crea una fila nueva en lugar
+   de actualizar una que ya no está en url_analysis. Postgres no permite
+   DETACH CONCURRENTLY mientras exista url_analysis_default, así que se usa
+   el DETACH normal (sólo metadatos) con lock_timeout para no quedar
+   encolado detrás de consultas largas.
+3. Exporta cada partición desvinculada a Parquet.
+4. Elimina la tabla.
+
+Es reanudable: si una pasada se interrumpe, la siguiente retoma las
+particiones que quedaron desvinculadas sin exportar.
+
+Uso:
+    python retention.py --months 12 --archive-dir /data/archive [--dry-run]
+"""
+import argparse
+import asyncio
+import os
+import re
+import sys
+from datetime import date
+from typing import List, Optional, Tuple
+
+PARTITION_PATTERN = re.compile(r"^url_analysis_p(\d{4})_(\d{2})$")
+EXPORT_COLUMNS = [
+    "id", "url", "url_hash", "analysis_result", "risk_level", "prediction",
+    "probability", "confidence", "features_extracted", "processing_time",
+    "threat_intelligence", "created_by", "created_at", "updated_at",
+]
+EXPORT_BATCH_ROWS = 50000
+DETACH_LOCK_TIMEOUT = "5s"
+
+
+def retention_cutoff(months: int, today: Optional[date] = None) -> date:
+    """Primer día del mes más antiguo que se conserva"""
+    today = today or date.today()
+    month_index = today.year * 12 + today.month - 1 - months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def archived_name(partition: str) -> str:
+    """Nombre de una partición archivada con --keep-detached: fuera de
+    PARTITION_PATTERN para que no se vuelva a procesar"""
+    return partition.replace("_p", "_archived_p", 1)
+
+
+async def list_expired_partitions(conn, cutoff: date) -> List[Tuple[str, str]]:
+    """Particiones (nombre, estado) cuyo mes termina antes del corte.
+
+    Estado: 'attached' o 'detached' (pasada anterior interrumpida).
+    """
+    rows = await conn.fetch("""
+        SELECT c.relname,
+               CASE WHEN i.inhrelid IS NULL THEN 'detached' ELSE 'attached' END AS state
+        FROM pg_class c
+        LEFT JOIN pg_inherits i
+               ON i.inhrelid = c.oid AND i.inhparent = 'url_analysis'::regclass
+        WHERE c.relkind = 'r' AND c.relname ~ '^url_analysis_p[0-9]{4}_[0-9]{2}$'
+          AND c.relnamespace = 'public'::regnamespace
+    """)
+    expired = []
+    for row in rows:
+        match = PARTITION_PATTERN.match(row["relname"])
+        if match is None:
+            continue
+        year, month = map(int, match.groups())
+        if date(year, month, 1) < cutoff:
+            expired.append((row["relname"], row["state"]))
+    return sorted(expired)
+
+
+async def export_partition(conn, partition: str, path: str) -> int:
+    """Vuelca la partición a Parquet en bloques; devuelve el número de filas"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("id", pa.string()), ("url", pa.string()), ("url_hash", pa.string()),
+        ("analysis_result", pa.string()), ("risk_level", pa.string()),
+        ("prediction", pa.string()), ("probability", pa.float64()),
+        ("confidence", pa.string()), ("features_extracted", pa.int32()),
+        ("processing_time", pa.float64()), ("threat_intelligence", pa.string()),
+        ("created_by", pa.string()), ("created_at", pa.timestamp("us", tz="UTC")),
+        ("updated_at", pa.timestamp("us", tz="UTC")),
+    ])
+    # Casts en SQL para que Parquet reciba tipos simples (texto y float)
+    query = (
+        "SELECT id::text, url, url_hash, analysis_result::text, risk_level, prediction, "
+        "probability::float8, confidence, features_extracted, processing_time::float8, "
+        "threat_intelligence::text, created_by, created_at, updated_at "
+        f'FROM "{partition}" ORDER BY created_at'
+    )
+    tmp_path = path + ".tmp"
+    total = 0
+    writer = pq.ParquetWriter(tmp_path, schema, compression="zstd")
+    try:
+        async with conn.transaction():
+            cursor = await conn.cursor(query)
+            while True:
+                rows = await cursor.fetch(EXPORT_BATCH_ROWS)
+                if not rows:
+                    break
+                columns = {c: [row[i] for row in rows] for i, c in enumerate(EXPORT_COLUMNS)}
+                writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+                total += len(rows)
+    finally:
+        writer.close()
+    # Sólo se publica el archivo completo
+    os.replace(tmp_path, path)
+    return total
+
+
+async def retire_partition(conn, partition: str, state: str, archive_dir: str, keep_detached: bool):
+    async with conn.transaction():
+        # Sólo se borran las entradas del índice que apuntan a esta partición.
+        # Va antes del DETACH para que el bloqueo exclusivo dure lo mínimo; una
+        # partición ya desvinculada (pasada anterior) repite el borrado sin efecto.
+        await conn.execute(
+            f'DELETE FROM url_analysis_index i USING "{partition}" p '
+            f"WHERE i.url_hash = p.url_hash AND i.id = p.id"
+        )
+        if state == "attached":
+            await conn.execute(f"SET LOCAL lock_timeout = '{DETACH_LOCK_TIMEOUT}'")
+            await conn.execute(f'ALTER TABLE url_analysis DETACH PARTITION "{partition}"')
+
+    path = os.path.join(archive_dir, f"{partition}.parquet")
+    exported = await export_partition(conn, partition, path)
+    print(f"{partition}: {exported} filas exportadas a {path}", flush=True)
+
+    async with conn.transaction():
+        if keep_detached:
+            await conn.execute(f'ALTER TABLE "{partition}" RENAME TO "{archived_name(partition)}"')
+        else:
+            await conn.execute(f'DROP TABLE "{partition}"')
+
+
+async def run(args: argparse.Namespace) -> int:
+    import asyncpg
+
+    conn = await asyncpg.connect(args.dsn)
+    status = 0
+    try:
+        try:
+            created = await conn.fetchval("SELECT ensure_url_analysis_partitions($1)", args.months_ahead)
+            print(f"Particiones nuevas: {created}", flush=True)
+        except asyncpg.PostgresError as e:
+            print(f"Error creando particiones: {e}", file=sys.stderr, flush=True)
+            status = 1
+
+        cutoff = retention_cutoff(args.months)
+        expired = await list_expired_partitions(conn, cutoff)
+        if not expired:
+            print(f"Sin particiones anteriores a {cutoff}", flush=True)
+            return status
+
+        for partition, state in expired:
+            if args.dry_run:
+                print(f"[dry-run] {partition} ({state}) se archivaría", flush=True)
+                continue
+            await retire_partition(conn, partition, state, args.archive_dir, args.keep_detached)
+        return status
+    finally:
+        await conn.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Retención y archivado de url_analysis")
+    parser.add_argument("--months", type=int, default=int(os.getenv("RETENTION_MONTHS", "12")),
+                        help="Meses completos a conservar además del actual")
+    parser.add_argument("--months-ahead", type=int, default=2,
+                        help="Meses futuros para los que crear particiones")
+    parser.add_argument("--archive-dir", default=os.getenv("ARCHIVE_DIR", "archive"),
+                        help="Directorio de destino de los Parquet")
+    parser.add_argument("--dsn", default=os.getenv("DATABASE_URL"),
+                        help="DSN de Postgres (por defecto $DATABASE_URL)")
+    parser.add_argument("--keep-detached", action="store_true",
+                        help="Conservar la tabla exportada como url_analysis_archived_pAAAA_MM")
+    parser.add_argument("--dry-run", action="store_true", help="Sólo listar lo que se archivaría")
+    args = parser.parse_args(argv)
+
+    if not args.dsn:
+        parser.error("se requiere --dsn o DATABASE_URL")
+    os.makedirs(args.archive_dir, exist_ok=True)
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+"""Serialización rápida y compresión para endpoints masivos.
+
+Ruta opcional (opt-in) para integraciones que descargan miles de veredictos:
+- JSON con ``orjson`` si está instalado (``?fast=true``)
+- MessagePack negociado con ``Accept: application/msgpack``
+- NDJSON en streaming con ``Accept: application/x-ndjson``
+- Compresión gzip o zstd según ``Accept-Encoding`` para cuerpos grandes
+
+Sin estos parámetros las respuestas siguen el camino por defecto de FastAPI.
+``Accept`` y ``Accept-Encoding`` se negocian respetando los valores ``q``; las
+dependencias opcionales se importan la primera vez que hacen falta.
+"""
+import importlib
+import json
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+NDJSON = "application/x-ndjson"
+
+# Tamaño mínimo para comprimir (por debajo no compensa la CPU)
+COMPRESS_MIN_BYTES = 1024
+# Filas a partir de las cuales las listas se envían en streaming
+STREAM_MIN_ITEMS = 500
+# Tamaño de cada bloque enviado al cliente en streaming
+STREAM_CHUNK_BYTES = 64 * 1024
+
+# Columnas de url_analysis que repiten datos de analysis_result
+DUPLICATED_COLUMNS = (
+    "prediction", "risk_level", "probability", "confidence",
+    "features_extracted", "threat_intelligence",
+)
+COMPACT_COLUMNS = "id, url, url_hash, analysis_result, processing_time, created_by, created_at, updated_at"
+
+# Dependencias opcionales por formato/codificación (ver requirements.txt)
+_OPTIONAL_MODULES = {MSGPACK: "msgpack", "zstd": "zstandard"}
+_modules: Dict[str, Any] = {}
+
+
+def _optional(name: str):
+    """Importa un módulo opcional en el primer uso; None si no está instalado"""
+    if name not in _modules:
+        try:
+            _modules[name] = importlib.import_module(name)
+        except ImportError:
+            _modules[name] = None
+    return _modules[name]
+
+
+def _available(option: str) -> bool:
+    module = _OPTIONAL_MODULES.get(option)
+    return module is None or _optional(module) is not None
+
+
+def dumps_json(obj: Any) -> bytes:
+    orjson = _optional("orjson")
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS, default=str)
+    return json.dumps(obj, separators=(",", ":"), default=str).encode()
+
+
+def dumps_msgpack(obj: Any) -> bytes:
+    return _optional("msgpack").packb(obj, default=str, use_bin_type=True)
+
+
+def parse_qualities(header: str) -> Dict[str, float]:
+    """Interpreta una cabecera tipo Accept: 'gzip;q=0.5, zstd' -> {'gzip': 0.5, 'zstd': 1.0}"""
+    qualities: Dict[str, float] = {}
+    for part in header.split(","):
+        token, *params = part.split(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = min(max(float(value), 0.0), 1.0)
+                except ValueError:
+                    quality = 0.0
+        qualities[token] = max(quality, qualities.get(token, 0.0))
+    return qualities
+
+
+def _negotiate(qualities: Dict[str, float], offers: Sequence[str], wildcards) -> Optional[str]:
+    """Elige la oferta con mayor q (> 0). A igual q gana la coincidencia exacta
+    frente a un comodín y después el orden de ``offers``."""
+    best, best_rank = None, (0.0, 0)
+    for offer in offers:
+        if offer in qualities:
+            rank = (qualities[offer], 1)
+        else:
+            matches = [qualities[w] for w in wildcards(offer) if w in qualities]
+            rank = (matches[0], 0) if matches else (0.0, 0)
+        if rank[0] > 0 and rank > best_rank and _available(offer):
+            best, best_rank = offer, rank
+    return best
+
+
+def _media_wildcards(media_type: str) -> List[str]:
+    return [media_type.split("/")[0] + "/*", "*/*"]
+
+
+def _media_type(request: Request) -> str:
+    accept = request.headers.get("accept")
+    if not accept:
+        return JSON
+    # JSON primero: ante un comodín o empate se mantiene el formato por defecto
+    chosen = _negotiate(parse_qualities(accept), (JSON, MSGPACK, NDJSON), _media_wildcards)
+    return chosen or JSON
+
+
+def _encoding(request: Request) -> Optional[str]:
+    accepted = parse_qualities(request.headers.get("accept-encoding", ""))
+    return _negotiate(accepted, ("zstd", "gzip"), lambda _: ["*"])
+
+
+def wants_fast_path(request: Request) -> bool:
+    """Indica si el cliente pidió la ruta rápida (formato o parámetro explícito)"""
+    if request.query_params.get("fast", "").lower() in ("1", "true", "yes"):
+        return True
+    return _media_type(request) != JSON
+
+
+def is_compact(request: Request) -> bool:
+    return request.query_params.get("compact", "").lower() in ("1", "true", "yes")
+
+
+def compact_rows(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Quita las columnas que duplican analysis_result (se serializan una sola vez)"""
+    return [{k: v for k, v in row.items() if k not in DUPLICATED_COLUMNS} for row in rows]
+
+
+def _compressor(encoding: str):
+    if encoding == "zstd":
+        return _optional("zstandard").ZstdCompressor(level=3).compressobj()
+    return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def fast_response(request: Request, content: Any, status_code: int = 200) -> Response:
+    """Serializa ``content`` en el formato negociado y comprime si es grande"""
+    media_type = _media_type(request)
+    if media_type == MSGPACK:
+        body = dumps_msgpack(content)
+    elif media_type == NDJSON and isinstance(content, list):
+        body = b"".join(dumps_json(item) + b"\n" for item in content)
+    else:
+        media_type = JSON
+        body = dumps_json(content)
+
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    encoding = _encoding(request)
+    if encoding and len(body) >= COMPRESS_MIN_BYTES:
+        # Mismo compresor que las respuestas en streaming
+        body = b"".join(_compress_stream(iter((body,)), encoding))
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, status_code=status_code, media_type=media_type, headers=headers)
+
+
+def _stream_items(items: List[Any], media_type: str) -> Iterator[bytes]:
+    if media_type == MSGPACK:
+        packer = _optional("msgpack").Packer(default=str, use_bin_type=True)
+        yield packer.pack_array_header(len(items))
+        for item in items:
+            yield packer.pack(item)
+    elif media_type == NDJSON:
+        for item in items:
+            yield dumps_json(item) + b"\n"
+    else:
+        yield b"["
+        for index, item in enumerate(items):
+            yield (b"," if index else b"") + dumps_json(item)
+        yield b"]"
+
+
+def _buffered(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """Agrupa fragmentos pequeños para no hacer un envío ASGI por fila"""
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer) >= STREAM_CHUNK_BYTES:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+def _compress_stream(chunks: Iterator[bytes], encoding: str) -> Iterator[bytes]:
+    compressor = _compressor(encoding)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def vary_accept(response: Response):
+    """Las respuestas por defecto también dependen de Accept (la ruta rápida se negocia con él)"""
+    response.headers["Vary"] = "Accept"
+
+
+def list_response(request: Request, items: List[Any]) -> Response:
+    """Respuesta para listas: en streaming si son grandes, si no ``fast_response``"""
+    if len(items) < STREAM_MIN_ITEMS:
+        return fast_response(request, items)
+
+    media_type = _media_type(request)
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    chunks = _buffered(_stream_items(items, media_type))
+    encoding = _encoding(request)
+    if encoding:
+        chunks = _compress_stream(chunks, encoding)
+        headers["Content-Encoding"] = encoding
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
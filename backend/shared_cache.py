@@ -0,0 +1,297 @@
+"""Caché de veredictos compartida entre workers mediante memoria compartida.
+
+El segmento es una tabla hash de tamaño fijo: cada slot guarda una huella de
+la clave, la expiración y el valor serializado en JSON. Las lecturas no toman
+lock (seqlock por slot); las escrituras se serializan con un ``flock`` sobre un
+archivo auxiliar para que varios procesos de uvicorn puedan compartirla.
+
+El segmento tiene nombre fijo: cada proceso lo abre con ``open()`` (lo crea el
+primero, los demás se conectan), de modo que funciona igual con
+``python main.py`` que con ``uvicorn main:app --workers N``. Una cabecera
+guarda la geometría y los pids conectados; el último en cerrar elimina el
+segmento. Los pids de procesos muertos (SIGKILL, OOM) se descartan al abrir y
+un segmento sin procesos vivos se recrea desde cero.
+"""
+import hashlib
+import json
+import logging
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: sólo se protege dentro del proceso
+    fcntl = None
+
+# Cabecera del segmento: magic, slots, tamaño de slot y tabla de pids conectados
+_SEGMENT = struct.Struct("<8sII")
+_SEGMENT_MAGIC = b"PHCACHE2"
+_SEGMENT_HEADER_SIZE = 1024
+_MAX_PROCESSES = (_SEGMENT_HEADER_SIZE - _SEGMENT.size) // 4
+_PIDS = struct.Struct(f"<{_MAX_PROCESSES}I")
+
+# tmpfs donde POSIX crea los segmentos (64 MiB por defecto en Docker/k8s)
+_SHM_DIR = "/dev/shm"
+
+# Cabecera de slot: seq, huella, expiración, longitud del payload
+_HEADER = struct.Struct("<QQdI")
+_HEADER_SIZE = 32
+_PROBES = 4
+
+# Python 3.13+ permite no registrar el segmento en el resource_tracker
+_TRACK_PARAM = sys.version_info >= (3, 13)
+
+
+class CacheGeometryError(RuntimeError):
+    """El segmento existente, en uso por otros procesos, tiene otra geometría"""
+
+
+class CacheSpaceError(RuntimeError):
+    """No hay espacio en /dev/shm para el segmento"""
+
+
+def _check_shm_space(size: int):
+    # SharedMemory sólo trunca un archivo disperso: si tmpfs no tiene sitio, el
+    # fallo llega después como SIGBUS al escribir en una página fuera del límite
+    if not os.path.isdir(_SHM_DIR):
+        return
+    stat = os.statvfs(_SHM_DIR)
+    available = stat.f_bavail * stat.f_frsize
+    if available < size:
+        raise CacheSpaceError(
+            f"{_SHM_DIR} tiene {available // 2**20} MiB libres y el segmento necesita "
+            f"{size // 2**20} MiB (reducir CACHE_SLOTS o ampliar /dev/shm)"
+        )
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _open_segment(name: str, create: bool, size: int = 0) -> shared_memory.SharedMemory:
+    # La vida del segmento la gestiona el contador de la cabecera, no el
+    # resource_tracker (que lo borraría al salir el proceso que lo creó).
+    if _TRACK_PARAM:
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def _unlink_segment(shm: shared_memory.SharedMemory):
+    if not _TRACK_PARAM:
+        # unlink() des-registra el nombre; se registra antes para mantener el par
+        resource_tracker.register(shm._name, "shared_memory")
+    shm.unlink()
+
+
+class SharedVerdictCache:
+    """Tabla hash en un segmento ``SharedMemory`` accesible por nombre."""
+
+    def __init__(self, shm: shared_memory.SharedMemory, slots: int, slot_size: int, lock_fd: int):
+        self._shm = shm
+        self._buf = shm.buf
+        self.slots = slots
+        self.slot_size = slot_size
+        self._local_lock = threading.Lock()
+        self._lock_fd = lock_fd
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @classmethod
+    def open(cls, name: str, slots: int, slot_size: int) -> "SharedVerdictCache":
+        """Crea el segmento ``name`` o se conecta a él si ya existe.
+
+        Lanza ``CacheGeometryError`` si procesos vivos usan el segmento con otra
+        geometría y ``CacheSpaceError`` si /dev/shm no tiene sitio para crearlo.
+        """
+        size = _SEGMENT_HEADER_SIZE + slots * slot_size
+        lock_path = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+        lock_fd = os.open(lock_path, os.O_CREAT | os.O_RDWR, 0o600)
+        lock = _FileLock(threading.Lock(), lock_fd)
+        try:
+            with lock:
+                try:
+                    shm = _open_segment(name, create=False)
+                except FileNotFoundError:
+                    shm = None
+
+                if shm is not None:
+                    magic, seg_slots, seg_slot_size = _SEGMENT.unpack_from(shm.buf, 0)
+                    pids = _live_pids(shm.buf) if magic == _SEGMENT_MAGIC else []
+                    if not pids:
+                        # Restos de un despliegue anterior (procesos muertos sin close()):
+                        # se recrea para no heredar su geometría ni sus veredictos
+                        logging.warning(f"Segmento de caché {name} sin procesos vivos; se recrea")
+                        _unlink_segment(shm)
+                        shm.close()
+                        shm = None
+                    elif (magic, seg_slots, seg_slot_size) != (_SEGMENT_MAGIC, slots, slot_size):
+                        shm.close()
+                        raise CacheGeometryError(
+                            f"Segmento {name} con geometría {seg_slots}x{seg_slot_size} en uso "
+                            f"por {len(pids)} procesos, se esperaba {slots}x{slot_size}"
+                        )
+
+                if shm is None:
+                    _check_shm_space(size)
+                    # POSIX entrega la memoria nueva ya a cero: no hace falta inicializarla
+                    shm = _open_segment(name, create=True, size=size)
+                    _SEGMENT.pack_into(shm.buf, 0, _SEGMENT_MAGIC, slots, slot_size)
+
+                _register_pid(shm.buf, os.getpid())
+        except BaseException:
+            os.close(lock_fd)
+            raise
+        return cls(shm, slots, slot_size, lock_fd)
+
+    @staticmethod
+    def _fingerprint(namespace: str, key: str) -> int:
+        digest = hashlib.sha256(f"{namespace}:{key}".encode()).digest()
+        return int.from_bytes(digest[:8], "little") or 1
+
+    def _offsets(self, fingerprint: int):
+        start = fingerprint % self.slots
+        for i in range(min(_PROBES, self.slots)):
+            yield _SEGMENT_HEADER_SIZE + ((start + i) % self.slots) * self.slot_size
+
+    def get(self, namespace: str, key: str) -> Optional[Dict[str, Any]]:
+        fingerprint = self._fingerprint(namespace, key)
+        now = time.time()
+        for offset in self._offsets(fingerprint):
+            seq, fp, expires, length = _HEADER.unpack_from(self._buf, offset)
+            if seq & 1 or fp != fingerprint:
+                continue
+            if expires < now:
+                break
+            payload = bytes(self._buf[offset + _HEADER_SIZE:offset + _HEADER_SIZE + length])
+            if _HEADER.unpack_from(self._buf, offset)[0] != seq:
+                # Un escritor modificó el slot mientras leíamos
+                break
+            try:
+                value = json.loads(payload)
+            except ValueError:
+                break
+            self.hits += 1
+            return value
+        self.misses += 1
+        return None
+
+    def set(self, namespace: str, key: str, value: Dict[str, Any], ttl: float) -> bool:
+        payload = json.dumps(value, separators=(",", ":"), default=str).encode()
+        if len(payload) > self.slot_size - _HEADER_SIZE:
+            return False
+
+        fingerprint = self._fingerprint(namespace, key)
+        now = time.time()
+        with self._write_lock():
+            target = None
+            oldest = None
+            for offset in self._offsets(fingerprint):
+                _, fp, expires, _ = _HEADER.unpack_from(self._buf, offset)
+                if fp == fingerprint or fp == 0 or expires < now:
+                    target = offset
+                    break
+                if oldest is None or expires < oldest[1]:
+                    oldest = (offset, expires)
+            if target is None:
+                target = oldest[0]
+
+            seq = _HEADER.unpack_from(self._buf, target)[0]
+            _HEADER.pack_into(self._buf, target, seq + 1, 0, 0.0, 0)
+            self._buf[target + _HEADER_SIZE:target + _HEADER_SIZE + len(payload)] = payload
+            _HEADER.pack_into(self._buf, target, seq + 2, fingerprint, now + ttl, len(payload))
+        return True
+
+    def attached_processes(self) -> int:
+        return sum(1 for pid in _PIDS.unpack_from(self._buf, _SEGMENT.size) if pid)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "segment": self.name,
+            "slots": self.slots,
+            "processes": self.attached_processes(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+    def close(self):
+        """Desconecta este proceso; el último en salir elimina el segmento."""
+        with self._write_lock():
+            _unregister_pid(self._buf, os.getpid())
+            remaining = len(_live_pids(self._buf))
+            self._buf = None
+            try:
+                self._shm.close()
+            except BufferError:
+                logging.warning("Segmento de caché con vistas activas; se cierra al salir")
+            if remaining == 0:
+                try:
+                    _unlink_segment(self._shm)
+                except FileNotFoundError:
+                    pass
+        os.close(self._lock_fd)
+
+    def _write_lock(self):
+        return _FileLock(self._local_lock, self._lock_fd)
+
+
+# Tabla de pids (se modifica siempre con el flock tomado)
+def _live_pids(buf) -> list:
+    """Pids conectados; descarta de la tabla los de procesos que ya no existen"""
+    pids = list(_PIDS.unpack_from(buf, _SEGMENT.size))
+    live = [pid if pid and _pid_alive(pid) else 0 for pid in pids]
+    if live != pids:
+        _PIDS.pack_into(buf, _SEGMENT.size, *live)
+    return [pid for pid in live if pid]
+
+
+def _register_pid(buf, pid: int):
+    pids = list(_PIDS.unpack_from(buf, _SEGMENT.size))
+    for index, current in enumerate(pids):
+        if current == 0 or not _pid_alive(current):
+            pids[index] = pid
+            _PIDS.pack_into(buf, _SEGMENT.size, *pids)
+            return
+    raise RuntimeError(f"Segmento de caché con más de {_MAX_PROCESSES} procesos conectados")
+
+
+def _unregister_pid(buf, pid: int):
+    pids = list(_PIDS.unpack_from(buf, _SEGMENT.size))
+    if pid in pids:
+        pids[pids.index(pid)] = 0
+        _PIDS.pack_into(buf, _SEGMENT.size, *pids)
+
+
+class _FileLock:
+    def __init__(self, local_lock: threading.Lock, fd: int):
+        self._local_lock = local_lock
+        self._fd = fd
+
+    def __enter__(self):
+        self._local_lock.acquire()
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._local_lock.release()
@@ -0,0 +1,55 @@
+import io
+import threading
+
+from bulk_scan import FingerprintSet, Progress, bounded, unique_urls
+
+
+def test_fingerprint_set_detects_duplicates():
+    seen = FingerprintSet(1 << 16)
+
+    assert seen.add("http://a.example/")
+    assert seen.add("http://b.example/")
+    assert not seen.add("http://a.example/")
+    assert seen.size == 2
+
+
+def test_fingerprint_set_resets_at_load_limit():
+    seen = FingerprintSet(0)  # tamaño mínimo: 1024 huecos
+    limit = int(1024 * FingerprintSet.MAX_LOAD)
+    for i in range(limit):
+        assert seen.add(f"http://{i}.example/")
+    assert seen.resets == 0 and seen.size == limit
+
+    # El siguiente valor nuevo vacía la tabla; lo anterior vuelve a ser nuevo
+    assert seen.add("http://nuevo.example/")
+    assert seen.resets == 1 and seen.size == 1
+    assert not seen.add("http://nuevo.example/")
+    assert seen.add("http://0.example/")
+
+
+def test_unique_urls_counts_invalid_and_skips_duplicates():
+    progress = Progress(interval=60, stream=io.StringIO())
+    urls = ["example.com", "HTTP://EXAMPLE.COM/", "ftp://x", "other.example"]
+
+    result = list(unique_urls(urls, progress, FingerprintSet(1 << 16)))
+
+    assert result == ["http://example.com/", "http://other.example/"]
+    assert progress.read == 4 and progress.invalid == 1
+
+
+def test_bounded_waits_for_a_free_slot():
+    slots = threading.Semaphore(2)
+    items = bounded(iter(range(5)), slots, threading.Event())
+
+    assert [next(items), next(items)] == [0, 1]
+    threading.Timer(0.1, slots.release).start()
+    assert next(items) == 2
+
+
+def test_bounded_stops_while_waiting():
+    slots, stop = threading.Semaphore(1), threading.Event()
+    items = bounded(iter(range(5)), slots, stop)
+
+    assert next(items) == 0
+    threading.Timer(0.1, stop.set).start()
+    assert list(items) == []
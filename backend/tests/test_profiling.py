@@ -0,0 +1,86 @@
+import multiprocessing
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from profiling import SlowRequestLog
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "STARTUP_STEPS", [])
+    monkeypatch.setattr(main.slow_requests, "directory", str(tmp_path))
+    monkeypatch.setattr(main.settings, "ADMIN_TOKEN", "secreto")
+    middleware = next(m for m in main.app.user_middleware if m.cls is main.ProfilingMiddleware)
+    monkeypatch.setitem(middleware.options, "admin_token", "secreto")
+    main.app.middleware_stack = None
+    with TestClient(main.app) as client:
+        yield client
+    main.app.middleware_stack = None
+
+
+def test_server_timing_only_for_admin(client):
+    assert "server-timing" not in client.get("/health").headers
+    assert "server-timing" not in client.get("/health", headers={"X-Admin-Token": "otro"}).headers
+    assert "server-timing" in client.get("/health", headers={"X-Admin-Token": "secreto"}).headers
+
+
+def test_admin_endpoints_check_token(client):
+    assert client.get("/admin/slow-requests").status_code == 403
+    assert client.get("/admin/slow-requests", headers={"X-Admin-Token": "secreto-no"}).status_code == 403
+    assert client.get("/admin/slow-requests", headers={"X-Admin-Token": "secreto"}).status_code == 200
+
+
+def test_profile_requires_admin_token(client):
+    main.slow_requests.clear()
+    client.get("/health", headers={"X-Profile": "1", "X-Admin-Token": "otro"})
+    assert main.slow_requests.entries() == []
+    client.get("/health", headers={"X-Profile": "1", "X-Admin-Token": "secreto"})
+    assert main.slow_requests.entries()[0]["profile"]
+
+
+def _record_in_worker(directory, path):
+    SlowRequestLog(10, directory).record({"timestamp": "2025-01-01T00:00:01", "path": path, "profile": None})
+
+
+def test_slow_requests_are_shared_between_workers(client, tmp_path):
+    main.slow_requests.clear()
+    main.slow_requests.record({"timestamp": "2025-01-01T00:00:00", "path": "/local", "profile": None})
+    worker = multiprocessing.get_context("fork").Process(target=_record_in_worker, args=(str(tmp_path), "/worker"))
+    worker.start()
+    worker.join()
+
+    response = client.get("/admin/slow-requests", headers={"X-Admin-Token": "secreto"})
+    entries = response.json()["entries"]
+    assert [e["path"] for e in entries] == ["/worker", "/local"]
+    assert entries[0]["pid"] == worker.pid and entries[1]["pid"] == os.getpid()
+
+    client.delete("/admin/slow-requests", headers={"X-Admin-Token": "secreto"})
+    assert main.slow_requests.entries() == []
+
+
+def test_slow_request_files_are_trimmed(tmp_path):
+    log = SlowRequestLog(3, str(tmp_path))
+    for i in range(20):
+        log.record({"timestamp": f"2025-01-01T00:00:{i:02d}", "path": f"/{i}"})
+
+    assert [e["path"] for e in log.entries()] == ["/19", "/18", "/17"]
+    with open(tmp_path / f"{os.getpid()}.jsonl") as f:
+        assert len(f.readlines()) <= 2 * 3
+
+
+def test_files_of_dead_workers_are_removed(tmp_path):
+    worker = multiprocessing.get_context("fork").Process(target=_record_in_worker, args=(str(tmp_path), "/old"))
+    worker.start()
+    worker.join()
+
+    assert SlowRequestLog(10, str(tmp_path)).entries() == []
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_partially_written_line_is_skipped(tmp_path):
+    (tmp_path / f"{os.getpid()}.jsonl").write_text('{"timestamp": "2025-01-01", "path": "/a"}\n{"pa')
+
+    assert [e["path"] for e in SlowRequestLog(10, str(tmp_path)).entries()] == ["/a"]
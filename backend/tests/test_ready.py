@@ -0,0 +1,60 @@
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+@pytest.fixture
+def database(monkeypatch):
+    state = {"up": False, "calls": 0, "hang": None}
+
+    def load_config():
+        state["calls"] += 1
+        if state["hang"] is not None:
+            state["hang"].wait(5)
+        if not state["up"]:
+            raise ConnectionError("connection refused")
+
+    monkeypatch.setattr(main, "STARTUP_STEPS", [("database", load_config, True)])
+    monkeypatch.setattr(main, "startup_state", {"ready": False, "import_seconds": None,
+                                                 "startup_seconds": None, "steps": {}, "errors": []})
+    monkeypatch.setattr(main, "_ready_retry", None)
+    return state
+
+
+def test_ready_is_503_while_database_is_down_and_recovers(database):
+    with TestClient(main.app) as client:
+        response = client.get("/ready")
+        assert response.status_code == 503
+        assert response.json()["errors"] == ["database: connection refused"]
+
+        database["up"] = True
+        response = client.get("/ready")
+        assert response.status_code == 200
+        assert response.json()["errors"] == []
+
+
+def test_ready_times_out_with_a_single_retry_in_flight(database, monkeypatch):
+    monkeypatch.setattr(main.settings, "READY_TIMEOUT", 0.05)
+    with TestClient(main.app) as client:
+        database["hang"] = threading.Event()
+        database["up"] = True
+        started = time.perf_counter()
+        assert client.get("/ready").status_code == 503
+        assert client.get("/ready").status_code == 503
+        assert time.perf_counter() - started < 2
+        # arranque + un único reintento, aunque hubo dos consultas
+        assert database["calls"] == 2
+
+        database["hang"].set()
+        for _ in range(50):
+            if main.startup_state["ready"]:
+                break
+            time.sleep(0.02)
+        response = client.get("/ready")
+        assert response.status_code == 200
+        assert response.json()["errors"] == []
+        assert database["calls"] == 2
@@ -0,0 +1,50 @@
+import asyncio
+from datetime import date
+
+import pytest
+
+from retention import PARTITION_PATTERN, archived_name, list_expired_partitions, retention_cutoff
+
+
+@pytest.mark.parametrize("months, today, expected", [
+    (12, date(2025, 6, 15), date(2024, 6, 1)),
+    (0, date(2025, 6, 15), date(2025, 6, 1)),
+    (5, date(2025, 6, 1), date(2025, 1, 1)),
+    (6, date(2025, 6, 30), date(2024, 12, 1)),
+    (1, date(2025, 1, 31), date(2024, 12, 1)),
+    (24, date(2025, 12, 31), date(2023, 12, 1)),
+])
+def test_retention_cutoff(months, today, expected):
+    assert retention_cutoff(months, today) == expected
+
+
+class FakeConnection:
+    def __init__(self, partitions):
+        self.partitions = partitions
+
+    async def fetch(self, query):
+        return [{"relname": name, "state": state} for name, state in self.partitions]
+
+
+def test_list_expired_partitions():
+    conn = FakeConnection([
+        ("url_analysis_p2024_07", "attached"),
+        ("url_analysis_p2024_05", "attached"),
+        ("url_analysis_p2024_06", "attached"),
+        ("url_analysis_p2024_04", "detached"),
+        ("url_analysis_archived_p2024_03", "detached"),
+        ("url_analysis_default", "attached"),
+    ])
+
+    expired = asyncio.run(list_expired_partitions(conn, date(2024, 6, 1)))
+
+    assert expired == [("url_analysis_p2024_04", "detached"), ("url_analysis_p2024_05", "attached")]
+
+
+def test_archived_name_is_outside_the_partition_pattern():
+    partition = "url_analysis_p2024_05"
+    archived = archived_name(partition)
+
+    assert archived == "url_analysis_archived_p2024_05"
+    assert PARTITION_PATTERN.match(partition)
+    assert PARTITION_PATTERN.match(archived) is None
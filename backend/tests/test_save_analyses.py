@@ -0,0 +1,145 @@
+import asyncio
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from analyzer import build_analysis_record
+from postgrest.exceptions import APIError
+
+
+class FakeRPC:
+    def __init__(self, client, payload):
+        self._client = client
+        self._payload = payload
+
+    def execute(self):
+        self._client.calls.append([row["url_hash"] for row in self._payload])
+        return self._client.respond(self._payload)
+
+
+class FakeResult:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeSupabase:
+    """Sustituto de supabase: devuelve (url_hash, id) por fila salvo que se indique otra cosa"""
+
+    def __init__(self, bad_urls=(), outage=False, drop_urls=()):
+        self.bad_urls = set(bad_urls)
+        self.outage = outage
+        self.drop_urls = set(drop_urls)
+        self.calls = []
+        self.ids = {}
+
+    def rpc(self, name, params):
+        assert name == "upsert_url_analyses"
+        return FakeRPC(self, params["payload"])
+
+    def respond(self, payload):
+        if self.outage:
+            raise ConnectionError("connection refused")
+        if any(row["url"] in self.bad_urls for row in payload):
+            raise APIError({"code": "22P02", "message": "invalid input syntax"})
+        data = []
+        for row in payload:
+            if row["url"] in self.drop_urls:
+                continue
+            row_id = self.ids.setdefault(row["url_hash"], str(uuid.uuid4()))
+            data.append({"url_hash": row["url_hash"], "id": row_id})
+        return FakeResult(data)
+
+
+def _records(urls):
+    result = {"risk_level": "LOW", "prediction": "LEGITIMATE", "probability": 0.1,
+              "confidence": "HIGH", "features_extracted": 10}
+    return [build_analysis_record(url, result, "test") for url in urls]
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    def install(**kwargs):
+        client = FakeSupabase(**kwargs)
+        monkeypatch.setattr(main, "get_supabase", lambda: client)
+        return client
+    return install
+
+
+def _save(records):
+    return asyncio.run(main.DatabaseService.save_analyses(records))
+
+
+def test_duplicates_share_one_row_and_id(fake_db):
+    client = fake_db()
+    records = _records(["http://a.example/", "http://b.example/", "HTTP://A.example"])
+
+    outcomes = _save(records)
+
+    assert len(client.calls) == 1
+    assert len(client.calls[0]) == 2
+    assert outcomes[0]["id"] == outcomes[2]["id"] == client.ids[records[0]["url_hash"]]
+    assert outcomes[1]["id"] != outcomes[0]["id"]
+    assert all(o["error"] is None for o in outcomes)
+
+
+def test_chunks_follow_batch_size(fake_db, monkeypatch):
+    monkeypatch.setattr(main.settings, "DB_BATCH_SIZE", 2)
+    client = fake_db()
+
+    outcomes = _save(_records([f"http://{i}.example/" for i in range(5)]))
+
+    assert [len(c) for c in client.calls] == [2, 2, 1]
+    assert all(o["id"] for o in outcomes)
+
+
+def test_data_error_is_isolated_by_bisection(fake_db):
+    urls = [f"http://{i}.example/" for i in range(16)]
+    client = fake_db(bad_urls={urls[5]})
+
+    outcomes = _save(_records(urls))
+
+    assert outcomes[5]["id"] is None and "22P02" in outcomes[5]["error"]
+    assert all(o["id"] and o["error"] is None for i, o in enumerate(outcomes) if i != 5)
+    # 1 intento + 2 por nivel de bisección (log2(16) = 4)
+    assert len(client.calls) <= 1 + 2 * 4
+
+
+def test_error_on_every_row_stops_splitting(fake_db):
+    urls = [f"http://{i}.example/" for i in range(1000)]
+    client = fake_db(bad_urls=set(urls))
+
+    outcomes = _save(_records(urls))
+
+    # El bloque y sus dos mitades fallan igual: no se baja fila a fila
+    assert len(client.calls) == 3
+    assert all(o["id"] is None and "22P02" in o["error"] for o in outcomes)
+
+
+def test_outage_fails_chunk_without_row_retries(fake_db):
+    client = fake_db(outage=True)
+
+    outcomes = _save(_records([f"http://{i}.example/" for i in range(50)]))
+
+    assert len(client.calls) == 1
+    assert all(o["id"] is None and "connection refused" in o["error"] for o in outcomes)
+
+
+def test_row_missing_from_result_is_reported(fake_db):
+    fake_db(drop_urls={"http://b.example/"})
+
+    outcomes = _save(_records(["http://a.example/", "http://b.example/"]))
+
+    assert outcomes[0]["id"] and outcomes[0]["error"] is None
+    assert outcomes[1]["id"] is None and outcomes[1]["error"]
+
+
+def test_created_by_longer_than_column_is_rejected(monkeypatch):
+    monkeypatch.setattr(main, "STARTUP_STEPS", [])
+    with TestClient(main.app) as client:
+        response = client.post("/analyze-batch", json={"urls": ["http://a.example/"], "created_by": "x" * 256})
+        assert response.status_code == 422
+        response = client.post("/analyze-csv?created_by=" + "x" * 256,
+                               files={"file": ("urls.csv", b"url\nhttp://a.example/\n")})
+        assert response.status_code == 422
@@ -0,0 +1,131 @@
+import json
+import subprocess
+import sys
+
+import msgpack
+import pytest
+import zstandard
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+import main
+import serialization
+
+
+def _request(accept=None, accept_encoding=None, query=b""):
+    headers = []
+    if accept is not None:
+        headers.append((b"accept", accept.encode()))
+    if accept_encoding is not None:
+        headers.append((b"accept-encoding", accept_encoding.encode()))
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers, "query_string": query})
+
+
+def test_parse_qualities():
+    assert serialization.parse_qualities("gzip;q=0.5, ZSTD , br;q=0, x;q=bad") == {
+        "gzip": 0.5, "zstd": 1.0, "br": 0.0, "x": 0.0,
+    }
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("", None),
+    ("gzip", "gzip"),
+    ("gzip, zstd", "zstd"),
+    ("gzip;q=0", None),
+    ("gzip;q=0, zstd;q=0", None),
+    ("zstd;q=0.2, gzip;q=0.8", "gzip"),
+    ("*", "zstd"),
+    ("*;q=0.5, zstd;q=0", "gzip"),
+    ("identity", None),
+])
+def test_encoding_negotiation(header, expected):
+    assert serialization._encoding(_request(accept_encoding=header)) == expected
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, serialization.JSON),
+    ("*/*", serialization.JSON),
+    ("application/msgpack", serialization.MSGPACK),
+    ("application/x-ndjson", serialization.NDJSON),
+    ("application/msgpack;q=0, application/json", serialization.JSON),
+    ("application/json;q=0.5, application/msgpack", serialization.MSGPACK),
+    ("application/msgpack, */*;q=0.1", serialization.MSGPACK),
+    ("application/*", serialization.JSON),
+    ("text/html", serialization.JSON),
+])
+def test_media_type_negotiation(header, expected):
+    assert serialization._media_type(_request(accept=header)) == expected
+
+
+def test_fast_path_only_when_requested():
+    assert not serialization.wants_fast_path(_request(accept="*/*"))
+    assert not serialization.wants_fast_path(_request(accept="application/msgpack;q=0"))
+    assert serialization.wants_fast_path(_request(accept="application/msgpack"))
+    assert serialization.wants_fast_path(_request(query=b"fast=true"))
+
+
+def test_optional_modules_are_not_imported_with_main():
+    code = "import sys, main; print(any(m in sys.modules for m in ('msgpack', 'zstandard')))"
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                            cwd=serialization.__file__.rsplit("/", 1)[0], check=True).stdout
+    assert output.strip() == "False"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    async def save_analyses(records):
+        return [{"id": str(i), "error": None} for i in range(len(records))]
+
+    monkeypatch.setattr(main.DatabaseService, "save_analyses", staticmethod(save_analyses))
+    monkeypatch.setattr(main, "STARTUP_STEPS", [])
+    with TestClient(main.app) as client:
+        yield client
+
+
+BATCH = {"urls": [f"https://site{i}.example.com/login" for i in range(40)], "created_by": "test"}
+
+
+def test_default_path_varies_on_accept(client):
+    response = client.post("/analyze-batch", json=BATCH)
+    assert response.headers["content-type"] == "application/json"
+    assert response.headers["vary"] == "Accept"
+    assert response.json()["total_processed"] == 40
+
+
+def test_msgpack_with_zstd(client):
+    response = client.post("/analyze-batch", json=BATCH,
+                           headers={"Accept": "application/msgpack", "Accept-Encoding": "zstd, gzip;q=0.5"})
+    assert response.headers["content-type"] == "application/msgpack"
+    assert response.headers["content-encoding"] == "zstd"
+    assert "Accept" in response.headers["vary"]
+    body = zstandard.ZstdDecompressor().decompressobj().decompress(response.content)
+    assert msgpack.unpackb(body)["total_processed"] == 40
+
+
+def test_gzip_refused_with_zero_quality(client):
+    response = client.post("/analyze-batch?fast=true", json=BATCH, headers={"Accept-Encoding": "gzip;q=0"})
+    assert "content-encoding" not in response.headers
+    assert json.loads(response.content)["total_processed"] == 40
+
+
+def test_gzip_when_preferred(client):
+    response = client.post("/analyze-batch?fast=true", json=BATCH,
+                           headers={"Accept-Encoding": "gzip, zstd;q=0.1"})
+    assert response.headers["content-encoding"] == "gzip"
+    # TestClient ya descomprime gzip
+    assert response.json()["total_processed"] == 40
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "zstd"])
+def test_fast_response_uses_the_stream_compressor(monkeypatch, encoding):
+    used = []
+    compressor = serialization._compressor
+    monkeypatch.setattr(serialization, "_compressor", lambda enc: used.append(enc) or compressor(enc))
+    content = [{"url": f"https://site{i}.example.com/"} for i in range(100)]
+
+    response = serialization.fast_response(_request(accept_encoding=encoding, query=b"fast=true"), content)
+
+    assert used == [encoding]
+    assert response.headers["content-encoding"] == encoding
+    body = b"".join(serialization._compress_stream(iter([serialization.dumps_json(content)]), encoding))
+    assert response.body == body
@@ -0,0 +1,156 @@
+import multiprocessing
+import os
+import signal
+import uuid
+from multiprocessing import shared_memory
+
+import pytest
+
+import shared_cache
+from shared_cache import CacheGeometryError, CacheSpaceError, SharedVerdictCache
+
+
+@pytest.fixture
+def segment_name():
+    return f"test_cache_{uuid.uuid4().hex[:12]}"
+
+
+@pytest.fixture
+def cache(segment_name):
+    cache = SharedVerdictCache.open(segment_name, slots=4, slot_size=256)
+    yield cache
+    cache.close()
+
+
+def _write_from_child(name):
+    child = SharedVerdictCache.open(name, slots=4, slot_size=256)
+    child.set("verdict", "http://child.example", {"prediction": "PHISHING"}, ttl=60)
+    child.close()
+
+
+def _open_and_hang(name, ready):
+    SharedVerdictCache.open(name, slots=4, slot_size=256).set("verdict", "k", {"v": "old"}, ttl=60)
+    ready.set()
+    signal.pause()
+
+
+def _slot_offset(cache, namespace, key):
+    fingerprint = cache._fingerprint(namespace, key)
+    for offset in cache._offsets(fingerprint):
+        if shared_cache._HEADER.unpack_from(cache._buf, offset)[1] == fingerprint:
+            return offset
+    raise AssertionError("clave no encontrada")
+
+
+def test_roundtrip_and_stats(cache):
+    assert cache.get("verdict", "http://a.example") is None
+    assert cache.set("verdict", "http://a.example", {"p": 1}, ttl=60)
+    assert cache.get("verdict", "http://a.example") == {"p": 1}
+    # Los espacios de nombres no colisionan
+    assert cache.get("reputation", "http://a.example") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["processes"]) == (1, 2, 1)
+
+
+def test_overwrite_same_key(cache):
+    cache.set("verdict", "k", {"v": 1}, ttl=60)
+    cache.set("verdict", "k", {"v": 2}, ttl=60)
+    assert cache.get("verdict", "k") == {"v": 2}
+
+
+def test_read_during_write_is_a_miss(cache):
+    cache.set("verdict", "k", {"v": 1}, ttl=60)
+    offset = _slot_offset(cache, "verdict", "k")
+    seq, fp, expires, length = shared_cache._HEADER.unpack_from(cache._buf, offset)
+    # seq impar: un escritor está a mitad de la escritura
+    shared_cache._HEADER.pack_into(cache._buf, offset, seq + 1, fp, expires, length)
+    assert cache.get("verdict", "k") is None
+    shared_cache._HEADER.pack_into(cache._buf, offset, seq + 2, fp, expires, length)
+    assert cache.get("verdict", "k") == {"v": 1}
+
+
+def test_ttl_expiry(cache):
+    cache.set("verdict", "k", {"v": 1}, ttl=-1)
+    assert cache.get("verdict", "k") is None
+
+
+def test_oversized_payload_is_rejected(cache):
+    assert not cache.set("verdict", "k", {"blob": "x" * 1000}, ttl=60)
+    assert cache.get("verdict", "k") is None
+
+
+def test_full_probe_window_evicts_earliest_expiry(cache):
+    # Con 4 slots y 4 sondeos todas las claves comparten ventana
+    for i in range(4):
+        cache.set("verdict", f"k{i}", {"i": i}, ttl=100 + i)
+    cache.set("verdict", "k4", {"i": 4}, ttl=200)
+    assert cache.get("verdict", "k0") is None
+    for i in range(1, 5):
+        assert cache.get("verdict", f"k{i}") == {"i": i}
+
+
+def test_expired_slot_is_reused_first(cache):
+    for i in range(4):
+        cache.set("verdict", f"k{i}", {"i": i}, ttl=-1 if i == 2 else 100)
+    cache.set("verdict", "new", {"i": 9}, ttl=100)
+    assert all(cache.get("verdict", f"k{i}") == {"i": i} for i in (0, 1, 3))
+
+
+def test_other_process_sees_writes(cache, segment_name):
+    cache.set("verdict", "http://parent.example", {"prediction": "LEGITIMATE"}, ttl=60)
+    process = multiprocessing.get_context("spawn").Process(target=_write_from_child, args=(segment_name,))
+    process.start()
+    process.join(30)
+    assert process.exitcode == 0
+    assert cache.get("verdict", "http://child.example") == {"prediction": "PHISHING"}
+    # El hijo cerró su conexión sin eliminar el segmento
+    assert cache.attached_processes() == 1
+
+
+def test_last_close_unlinks_segment(segment_name):
+    first = SharedVerdictCache.open(segment_name, slots=4, slot_size=256)
+    second = SharedVerdictCache.open(segment_name, slots=4, slot_size=256)
+    first.set("verdict", "k", {"v": 1}, ttl=60)
+    assert second.get("verdict", "k") == {"v": 1}
+    first.close()
+    assert second.attached_processes() == 1
+    second.close()
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=segment_name)
+
+
+def test_geometry_mismatch_is_rejected(cache, segment_name):
+    with pytest.raises(CacheGeometryError):
+        SharedVerdictCache.open(segment_name, slots=8, slot_size=256)
+    assert cache.attached_processes() == 1
+
+
+def test_segment_left_by_killed_process_is_recreated(segment_name):
+    context = multiprocessing.get_context("spawn")
+    ready = context.Event()
+    process = context.Process(target=_open_and_hang, args=(segment_name, ready))
+    process.start()
+    assert ready.wait(30)
+    os.kill(process.pid, signal.SIGKILL)
+    process.join(30)
+
+    # Sin procesos vivos, otra geometría no es un error y no se heredan veredictos
+    cache = SharedVerdictCache.open(segment_name, slots=8, slot_size=256)
+    try:
+        assert cache.attached_processes() == 1
+        assert cache.slots == 8
+        assert cache.get("verdict", "k") is None
+    finally:
+        cache.close()
+
+
+def test_not_enough_shm_space(segment_name, monkeypatch, tmp_path):
+    class Stat:
+        f_bavail, f_frsize = 1, 4096
+
+    monkeypatch.setattr(shared_cache, "_SHM_DIR", str(tmp_path))
+    monkeypatch.setattr(shared_cache.os, "statvfs", lambda path: Stat())
+    with pytest.raises(CacheSpaceError):
+        SharedVerdictCache.open(segment_name, slots=4, slot_size=4096)
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=segment_name)
@@ -0,0 +1,468 @@
+-- Migración 001: convierte url_analysis en una tabla particionada por mes
+--
+-- Para bases creadas con el setup.sql anterior (tabla única con UNIQUE en
+-- url_hash). Ejecutar en una ventana de mantenimiento: la tabla original se
+-- renombra a url_analysis_legacy y sus filas se copian a la nueva estructura
+-- dentro de una sola transacción, con url_hash recalculado sobre la URL
+-- canónica (las filas heredadas que resultan ser la misma URL se fusionan y
+-- se avisa con un NOTICE). Tras verificar los conteos:
+--     DROP TABLE url_analysis_legacy;
+--
+-- Las particiones futuras se crean con ensure_url_analysis_partitions(),
+-- que también ejecuta backend/retention.py en cada pasada (o programarla con
+-- pg_cron: SELECT cron.schedule('url-analysis-partitions', '0 0 * * *',
+-- 'SELECT ensure_url_analysis_partitions()');).
+
+BEGIN;
+
+LOCK TABLE url_analysis IN ACCESS EXCLUSIVE MODE;
+
+ALTER TABLE url_analysis RENAME TO url_analysis_legacy;
+ALTER TABLE url_analysis_legacy RENAME CONSTRAINT url_analysis_pkey TO url_analysis_legacy_pkey;
+ALTER TABLE url_analysis_legacy RENAME CONSTRAINT url_analysis_url_hash_key TO url_analysis_legacy_url_hash_key;
+DROP TRIGGER IF EXISTS update_url_analysis_updated_at ON url_analysis_legacy;
+DROP INDEX IF EXISTS idx_url_analysis_risk_level;
+DROP INDEX IF EXISTS idx_url_analysis_created_at;
+DROP INDEX IF EXISTS idx_url_analysis_url_hash;
+
+-- Índice global de URLs: url_hash -> fila en url_analysis
+CREATE TABLE IF NOT EXISTS url_analysis_index (
+    url_hash VARCHAR(64) PRIMARY KEY,
+    id UUID NOT NULL DEFAULT gen_random_uuid(),
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Tabla principal de URLs analizadas (particionada por mes)
+CREATE TABLE IF NOT EXISTS url_analysis (
+    id UUID NOT NULL DEFAULT gen_random_uuid(),
+    url TEXT NOT NULL,
+    url_hash VARCHAR(64) NOT NULL,
+    analysis_result JSONB NOT NULL,
+    risk_level VARCHAR(20) CHECK (risk_level IN ('LOW', 'MEDIUM', 'HIGH', 'CRITICAL')),
+    prediction VARCHAR(20) CHECK (prediction IN ('LEGITIMATE', 'SUSPICIOUS', 'PHISHING', 'MALWARE')),
+    probability DECIMAL(3,2),
+    confidence VARCHAR(10),
+    features_extracted INTEGER,
+    processing_time DECIMAL(8,4),
+    threat_intelligence JSONB,
+    created_by VARCHAR(255),
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Recoge filas fuera de rango; debe quedar vacía si las particiones se crean a tiempo
+CREATE TABLE IF NOT EXISTS url_analysis_default PARTITION OF url_analysis DEFAULT;
+
+-- BRIN en created_at: diminuto y adecuado para filtrar rangos de fechas
+CREATE INDEX IF NOT EXISTS idx_url_analysis_created_at_brin ON url_analysis USING BRIN (created_at) WITH (pages_per_range = 32);
+-- B-tree en created_at para ORDER BY created_at DESC LIMIT n (análisis recientes):
+-- BRIN no devuelve filas ordenadas
+CREATE INDEX IF NOT EXISTS idx_url_analysis_created_at ON url_analysis(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_url_analysis_risk_level ON url_analysis(risk_level);
+CREATE INDEX IF NOT EXISTS idx_url_analysis_prediction ON url_analysis(prediction);
+
+-- Crea las particiones mensuales desde start_month hasta months_ahead meses después del actual.
+-- Si url_analysis_default ya tiene filas de un mes nuevo (la partición no
+-- existía cuando se insertaron), Postgres no deja crear la partición: se
+-- desvincula la partición por defecto, se crea la del mes, se mueven a ella
+-- esas filas y se vuelve a vincular, todo en la misma transacción.
+CREATE OR REPLACE FUNCTION ensure_url_analysis_partitions(months_ahead INTEGER DEFAULT 2, start_month DATE DEFAULT NULL)
+RETURNS INTEGER AS $$
+DECLARE
+    month_start DATE := date_trunc('month', COALESCE(start_month, NOW()::DATE));
+    last_month DATE := date_trunc('month', NOW() + make_interval(months => months_ahead));
+    month_end DATE;
+    partition_name TEXT;
+    stranded BOOLEAN;
+    created INTEGER := 0;
+BEGIN
+    WHILE month_start <= last_month LOOP
+        partition_name := format('url_analysis_p%s', to_char(month_start, 'YYYY_MM'));
+        IF to_regclass(partition_name) IS NULL THEN
+            month_end := (month_start + INTERVAL '1 month')::DATE;
+            stranded := EXISTS (
+                SELECT 1 FROM url_analysis_default WHERE created_at >= month_start AND created_at < month_end
+            );
+            IF stranded THEN
+                ALTER TABLE url_analysis DETACH PARTITION url_analysis_default;
+            END IF;
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF url_analysis FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, month_end
+            );
+            IF stranded THEN
+                WITH moved AS (
+                    DELETE FROM url_analysis_default
+                    WHERE created_at >= month_start AND created_at < month_end
+                    RETURNING *
+                )
+                INSERT INTO url_analysis SELECT * FROM moved;
+                ALTER TABLE url_analysis ATTACH PARTITION url_analysis_default DEFAULT;
+            END IF;
+            created := created + 1;
+        END IF;
+        month_start := (month_start + INTERVAL '1 month')::DATE;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Upsert masivo por url_hash, común a upsert_url_analyses() (payload JSON) y
+-- upsert_url_analyses_from() (tabla de staging, sin pasar por JSONB).
+-- Devuelve (url_hash, id) de cada URL, tanto nuevas como existentes.
+-- updated_at se fija aquí, sin trigger BEFORE UPDATE.
+--
+-- - Las URLs nuevas reclaman su entrada en url_analysis_index con
+--   ON CONFLICT DO NOTHING; las existentes se leen del índice, así que
+--   reanalizar una URL no genera tuplas muertas en el índice.
+-- - Sólo se reescriben las filas cuyo veredicto cambió (processing_time no
+--   cuenta como cambio).
+-- - Si el índice apunta a una fila que ya no existe, la fila se vuelve a crear.
+-- - Las URLs que otra transacción insertó a la vez no son visibles en la foto
+--   de la sentencia: quedan con id NULL y se reintentan con una foto nueva.
+CREATE OR REPLACE FUNCTION upsert_url_analyses_core(payload JSONB, stage REGCLASS)
+RETURNS TABLE (url_hash VARCHAR, id UUID) AS $$
+DECLARE
+    source TEXT;
+    pending VARCHAR[];
+    missing VARCHAR[];
+    rec RECORD;
+    attempt INTEGER := 0;
+BEGIN
+    IF stage IS NULL THEN
+        source := 'jsonb_to_recordset($1) AS r(
+            url TEXT,
+            url_hash VARCHAR(64),
+            analysis_result JSONB,
+            risk_level VARCHAR(20),
+            prediction VARCHAR(20),
+            probability DECIMAL(3,2),
+            confidence VARCHAR(10),
+            features_extracted INTEGER,
+            processing_time DECIMAL(8,4),
+            threat_intelligence JSONB,
+            created_by VARCHAR(255),
+            created_at TIMESTAMPTZ
+        )';
+    ELSE
+        source := format('%s AS r', stage);
+    END IF;
+
+    LOOP
+        attempt := attempt + 1;
+        missing := '{}';
+        FOR rec IN EXECUTE format($sql$
+            WITH incoming AS (
+                SELECT DISTINCT ON (r.url_hash)
+                       r.url, r.url_hash, r.analysis_result, r.risk_level, r.prediction, r.probability,
+                       r.confidence, r.features_extracted, r.processing_time, r.threat_intelligence,
+                       r.created_by, COALESCE(r.created_at, NOW()) AS created_at
+                FROM %s
+                WHERE $2 IS NULL OR r.url_hash = ANY($2)
+            ),
+            claimed AS (
+                INSERT INTO url_analysis_index AS x (url_hash, created_at)
+                SELECT i.url_hash, i.created_at FROM incoming i
+                ON CONFLICT ON CONSTRAINT url_analysis_index_pkey DO NOTHING
+                RETURNING x.url_hash, x.id, x.created_at
+            ),
+            existing AS (
+                -- Foto del inicio de la sentencia: no incluye lo que inserta claimed.
+                -- Lleva los valores nuevos para que el UPDATE sólo cruce esta CTE con
+                -- url_analysis (sin estadísticas de las CTE, un cruce a tres elige mal el plan)
+                SELECT i.*, x.id, x.created_at AS row_created_at, (t.id IS NOT NULL) AS present,
+                       (t.url, t.analysis_result, t.risk_level, t.prediction, t.probability,
+                        t.confidence, t.features_extracted, t.threat_intelligence, t.created_by)
+                       IS DISTINCT FROM
+                       (i.url, i.analysis_result, i.risk_level, i.prediction, i.probability,
+                        i.confidence, i.features_extracted, i.threat_intelligence, i.created_by) AS changed
+                FROM incoming i
+                JOIN url_analysis_index x ON x.url_hash = i.url_hash
+                LEFT JOIN url_analysis t ON t.id = x.id AND t.created_at = x.created_at
+            ),
+            updated AS (
+                UPDATE url_analysis t SET
+                    url = e.url,
+                    analysis_result = e.analysis_result,
+                    risk_level = e.risk_level,
+                    prediction = e.prediction,
+                    probability = e.probability,
+                    confidence = e.confidence,
+                    features_extracted = e.features_extracted,
+                    processing_time = e.processing_time,
+                    threat_intelligence = e.threat_intelligence,
+                    created_by = e.created_by,
+                    updated_at = NOW()
+                FROM existing e
+                WHERE e.present AND e.changed AND t.id = e.id AND t.created_at = e.row_created_at
+                RETURNING t.id
+            ),
+            repointed AS (
+                -- Entrada del índice sin fila (p. ej. partición retirada): se recrea la fila
+                UPDATE url_analysis_index x SET created_at = e.created_at
+                FROM existing e
+                WHERE NOT e.present AND x.url_hash = e.url_hash
+                  AND x.id = e.id AND x.created_at = e.row_created_at
+                RETURNING x.url_hash, x.id, x.created_at
+            ),
+            inserted AS (
+                INSERT INTO url_analysis (
+                    id, url, url_hash, analysis_result, risk_level, prediction, probability,
+                    confidence, features_extracted, processing_time, threat_intelligence,
+                    created_by, created_at
+                )
+                SELECT n.id, i.url, i.url_hash, i.analysis_result, i.risk_level, i.prediction, i.probability,
+                       i.confidence, i.features_extracted, i.processing_time, i.threat_intelligence,
+                       i.created_by, n.created_at
+                FROM incoming i
+                JOIN (SELECT * FROM claimed UNION ALL SELECT * FROM repointed) n ON n.url_hash = i.url_hash
+                RETURNING url_analysis.id
+            ),
+            resolved AS (
+                SELECT c.url_hash, c.id FROM claimed c
+                UNION ALL
+                SELECT e.url_hash, e.id FROM existing e WHERE e.present
+                UNION ALL
+                SELECT p.url_hash, p.id FROM repointed p
+            )
+            SELECT r.url_hash, r.id FROM resolved r
+            UNION ALL
+            -- Sin resolver: se reintentan en la siguiente vuelta
+            SELECT i.url_hash, NULL FROM incoming i
+            WHERE NOT EXISTS (SELECT 1 FROM resolved r WHERE r.url_hash = i.url_hash)
+        $sql$, source) USING payload, pending
+        LOOP
+            IF rec.id IS NULL THEN
+                missing := missing || rec.url_hash;
+            ELSE
+                url_hash := rec.url_hash;
+                id := rec.id;
+                RETURN NEXT;
+            END IF;
+        END LOOP;
+
+        EXIT WHEN cardinality(missing) = 0;
+        IF attempt >= 3 THEN
+            RAISE EXCEPTION 'upsert_url_analyses: % URLs sin resolver tras % intentos', cardinality(missing), attempt;
+        END IF;
+        pending := missing;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- payload es un array JSON con las columnas de url_analysis (API)
+CREATE OR REPLACE FUNCTION upsert_url_analyses(payload JSONB)
+RETURNS TABLE (url_hash VARCHAR, id UUID) AS $$
+    SELECT * FROM upsert_url_analyses_core(payload, NULL);
+$$ LANGUAGE sql;
+
+-- stage es una tabla con las columnas de url_analysis, p. ej. la tabla
+-- temporal que llena bulk_scan.py con COPY
+CREATE OR REPLACE FUNCTION upsert_url_analyses_from(stage REGCLASS)
+RETURNS TABLE (url_hash VARCHAR, id UUID) AS $$
+    SELECT * FROM upsert_url_analyses_core(NULL, stage);
+$$ LANGUAGE sql;
+
+-- Equivalente SQL de analyzer.canonicalize_url() (reglas de urllib.parse de
+-- Python 3.11): devuelve NULL si la URL no es válida. La migración la usa para
+-- recalcular url_hash de las filas heredadas con la misma clave que la API.
+CREATE OR REPLACE FUNCTION canonicalize_url(raw TEXT)
+RETURNS TEXT AS $$
+DECLARE
+    -- Lo que quita str.strip(): espacios ASCII, \x1c-\x1f y espacios Unicode
+    ws CONSTANT TEXT := E' \t\n\u000b\f\r\u001c\u001d\u001e\u001f\u0085\u00a0\u1680'
+        '\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200a'
+        '\u2028\u2029\u202f\u205f\u3000';
+    u TEXT;
+    scheme TEXT;
+    netloc TEXT;
+    rest TEXT;
+    path TEXT;
+    query TEXT := '';
+    segment TEXT;
+    bracketed TEXT;
+    zone TEXT;
+    userinfo TEXT;
+    username TEXT := '';
+    password TEXT := '';
+    hostinfo TEXT;
+    host TEXT;
+    port_text TEXT := '';
+    port NUMERIC;
+    pos INTEGER;
+BEGIN
+    u := btrim(raw, ws);
+    IF u = '' THEN
+        RETURN NULL;
+    END IF;
+    IF strpos(u, '://') = 0 THEN
+        u := 'http://' || u;
+    END IF;
+    -- urlsplit(): quita controles C0/espacios iniciales y \t\r\n
+    u := translate(regexp_replace(u, '^[\x01-\x20]+', ''), E'\t\r\n', '');
+
+    pos := strpos(u, ':');
+    scheme := lower(left(u, pos - 1));
+    rest := substr(u, pos + 1);
+    IF pos = 0 OR scheme NOT IN ('http', 'https') OR left(rest, 2) <> '//' THEN
+        RETURN NULL;
+    END IF;
+    rest := substr(rest, 3);
+    netloc := substring(rest FROM '^[^/?#]*');
+    rest := split_part(substr(rest, length(netloc) + 1), '#', 1);
+    pos := strpos(rest, '?');
+    IF pos > 0 THEN
+        query := substr(rest, pos + 1);
+        path := left(rest, pos - 1);
+    ELSE
+        path := rest;
+    END IF;
+    -- urlparse() separa ';params' del último segmento y urlunparse() omite el ';' si van vacíos
+    segment := substring(path FROM '[^/]*$');
+    IF strpos(segment, ';') > 0 AND strpos(segment, ';') = length(segment) THEN
+        path := left(path, -1);
+    END IF;
+
+    -- Corchetes: IPv6 (con zona opcional) o IPvFuture, nunca IPv4
+    IF (strpos(netloc, '[') > 0) <> (strpos(netloc, ']') > 0) THEN
+        RETURN NULL;
+    END IF;
+    IF strpos(netloc, '[') > 0 THEN
+        bracketed := split_part(substr(netloc, strpos(netloc, '[') + 1), ']', 1);
+        IF left(bracketed, 1) = 'v' THEN
+            IF bracketed !~ '^v[a-fA-F0-9]+\..+$' THEN
+                RETURN NULL;
+            END IF;
+        ELSE
+            IF strpos(bracketed, '%') > 0 THEN
+                zone := substr(bracketed, strpos(bracketed, '%') + 1);
+                IF zone = '' OR strpos(zone, '%') > 0 THEN
+                    RETURN NULL;
+                END IF;
+                bracketed := split_part(bracketed, '%', 1);
+            END IF;
+            BEGIN
+                IF family(bracketed::INET) <> 6 THEN
+                    RETURN NULL;
+                END IF;
+            EXCEPTION WHEN invalid_text_representation THEN
+                RETURN NULL;
+            END;
+        END IF;
+    END IF;
+    -- Caracteres que bajo NFKC se convierten en separadores de URL
+    IF netloc ~ '[^\x01-\x7f]' THEN
+        segment := translate(netloc, '@:#?', '');
+        IF normalize(segment, NFKC) <> segment AND normalize(segment, NFKC) ~ '[/?#@:]' THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+
+    IF strpos(netloc, '@') > 0 THEN
+        userinfo := substring(netloc FROM '^(.*)@');
+        hostinfo := substring(netloc FROM '@([^@]*)$');
+        username := split_part(userinfo, ':', 1);
+        IF strpos(userinfo, ':') > 0 THEN
+            password := substr(userinfo, strpos(userinfo, ':') + 1);
+        END IF;
+    ELSE
+        hostinfo := netloc;
+    END IF;
+    IF strpos(hostinfo, '[') > 0 THEN
+        bracketed := substr(hostinfo, strpos(hostinfo, '[') + 1);
+        host := split_part(bracketed, ']', 1);
+        IF strpos(bracketed, ']') > 0 THEN
+            rest := substr(bracketed, strpos(bracketed, ']') + 1);
+            IF strpos(rest, ':') > 0 THEN
+                port_text := substr(rest, strpos(rest, ':') + 1);
+            END IF;
+        END IF;
+    ELSE
+        host := split_part(hostinfo, ':', 1);
+        IF strpos(hostinfo, ':') > 0 THEN
+            port_text := substr(hostinfo, strpos(hostinfo, ':') + 1);
+        END IF;
+    END IF;
+    IF port_text <> '' THEN
+        IF port_text !~ '^[0-9]+$' THEN
+            RETURN NULL;
+        END IF;
+        port := port_text::NUMERIC;
+        IF port > 65535 THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+
+    -- Minúsculas salvo la zona IPv6; sin punto final
+    IF strpos(host, '%') > 0 THEN
+        host := lower(split_part(host, '%', 1)) || substr(host, strpos(host, '%'));
+    ELSE
+        host := lower(host);
+    END IF;
+    host := rtrim(host, '.');
+    IF host = '' THEN
+        RETURN NULL;
+    END IF;
+    IF strpos(host, ':') > 0 THEN
+        host := '[' || host || ']';
+    END IF;
+    IF port IS NOT NULL AND port <> (CASE scheme WHEN 'http' THEN 80 ELSE 443 END) THEN
+        host := host || ':' || port;
+    END IF;
+    IF username <> '' THEN
+        host := username || CASE WHEN password <> '' THEN ':' || password ELSE '' END || '@' || host;
+    END IF;
+    RETURN scheme || '://' || host || CASE WHEN path = '' THEN '/' ELSE path END
+        || CASE WHEN query <> '' THEN '?' || query ELSE '' END;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE STRICT;
+
+-- url_hash es el sha256 de la URL canónica (analyzer.url_hash); las filas
+-- heredadas usaban la URL tal cual. Se recalcula y, si varias filas heredadas
+-- colapsan en la misma URL canónica, se conserva la actualizada más
+-- recientemente con la fecha de la primera vez que se vio.
+CREATE TEMP TABLE url_analysis_rehashed ON COMMIT DROP AS
+SELECT DISTINCT ON (c.url_hash)
+       l.id, c.url, c.url_hash, l.analysis_result, l.risk_level, l.prediction, l.probability,
+       l.confidence, l.features_extracted, l.processing_time, l.threat_intelligence, l.created_by,
+       MIN(COALESCE(l.created_at, l.updated_at, NOW())) OVER (PARTITION BY c.url_hash) AS created_at,
+       l.updated_at
+FROM url_analysis_legacy l
+CROSS JOIN LATERAL (SELECT COALESCE(canonicalize_url(l.url), l.url) AS url) n
+CROSS JOIN LATERAL (SELECT n.url, encode(sha256(convert_to(n.url, 'UTF8')), 'hex') AS url_hash) c
+ORDER BY c.url_hash, l.updated_at DESC NULLS LAST, l.created_at DESC NULLS LAST;
+
+DO $$
+DECLARE
+    merged BIGINT := (SELECT count(*) FROM url_analysis_legacy) - (SELECT count(*) FROM url_analysis_rehashed);
+BEGIN
+    IF merged > 0 THEN
+        RAISE NOTICE '% filas heredadas eran la misma URL canónica que otra y no se copian', merged;
+    END IF;
+END;
+$$;
+
+-- Particiones desde el mes del análisis más antiguo hasta dos meses adelante
+SELECT ensure_url_analysis_partitions(2, (SELECT MIN(created_at)::DATE FROM url_analysis_rehashed));
+
+INSERT INTO url_analysis_index (url_hash, id, created_at)
+SELECT url_hash, id, created_at
+FROM url_analysis_rehashed;
+
+INSERT INTO url_analysis (
+    id, url, url_hash, analysis_result, risk_level, prediction, probability,
+    confidence, features_extracted, processing_time, threat_intelligence,
+    created_by, created_at, updated_at
+)
+SELECT id, url, url_hash, analysis_result, risk_level, prediction, probability,
+       confidence, features_extracted, processing_time, threat_intelligence,
+       created_by, created_at, updated_at
+FROM url_analysis_rehashed
+ORDER BY created_at;
+
+ANALYZE url_analysis_index;
+ANALYZE url_analysis;
+
+COMMIT;
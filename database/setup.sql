@@ -1,8 +1,21 @@
--- Tabla principal de URLs analizadas
+-- url_analysis se particiona por mes en created_at. Postgres exige que las
+-- restricciones UNIQUE de una tabla particionada incluyan la clave de
+-- partición, así que la unicidad global de url_hash vive en url_analysis_index
+-- y los upserts pasan por upsert_url_analyses() (ver más abajo).
+-- Para convertir una base existente usar migrations/001_partition_url_analysis.sql.
+
+-- Índice global de URLs: url_hash -> fila en url_analysis
+CREATE TABLE IF NOT EXISTS url_analysis_index (
+    url_hash VARCHAR(64) PRIMARY KEY,
+    id UUID NOT NULL DEFAULT gen_random_uuid(),
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Tabla principal de URLs analizadas (particionada por mes)
 CREATE TABLE IF NOT EXISTS url_analysis (
-    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    id UUID NOT NULL DEFAULT gen_random_uuid(),
     url TEXT NOT NULL,
-    url_hash VARCHAR(64) UNIQUE NOT NULL,
+    url_hash VARCHAR(64) NOT NULL,
     analysis_result JSONB NOT NULL,
     risk_level VARCHAR(20) CHECK (risk_level IN ('LOW', 'MEDIUM', 'HIGH', 'CRITICAL')),
     prediction VARCHAR(20) CHECK (prediction IN ('LEGITIMATE', 'SUSPICIOUS', 'PHISHING', 'MALWARE')),
@@ -12,9 +25,21 @@ CREATE TABLE IF NOT EXISTS url_analysis (
     processing_time DECIMAL(8,4),
     threat_intelligence JSONB,
     created_by VARCHAR(255),
-    created_at TIMESTAMPTZ DEFAULT NOW(),
-    updated_at TIMESTAMPTZ DEFAULT NOW()
-);
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Recoge filas fuera de rango; debe quedar vacía si las particiones se crean a tiempo
+CREATE TABLE IF NOT EXISTS url_analysis_default PARTITION OF url_analysis DEFAULT;
+
+-- BRIN en created_at: diminuto y adecuado para filtrar rangos de fechas
+CREATE INDEX IF NOT EXISTS idx_url_analysis_created_at_brin ON url_analysis USING BRIN (created_at) WITH (pages_per_range = 32);
+-- B-tree en created_at para ORDER BY created_at DESC LIMIT n (análisis recientes):
+-- BRIN no devuelve filas ordenadas
+CREATE INDEX IF NOT EXISTS idx_url_analysis_created_at ON url_analysis(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_url_analysis_risk_level ON url_analysis(risk_level);
+CREATE INDEX IF NOT EXISTS idx_url_analysis_prediction ON url_analysis(prediction);
 
 -- Tabla de estadísticas y reportes
 CREATE TABLE IF NOT EXISTS analysis_reports (
@@ -50,9 +75,6 @@ CREATE TABLE IF NOT EXISTS system_config (
 );
 
 -- Índices para optimización
-CREATE INDEX IF NOT EXISTS idx_url_analysis_risk_level ON url_analysis(risk_level);
-CREATE INDEX IF NOT EXISTS idx_url_analysis_created_at ON url_analysis(created_at);
-CREATE INDEX IF NOT EXISTS idx_url_analysis_url_hash ON url_analysis(url_hash);
 CREATE INDEX IF NOT EXISTS idx_analysis_reports_date_range ON analysis_reports(date_range);
 
 -- Triggers para actualización de timestamps
@@ -64,10 +86,214 @@ BEGIN
 END;
 $$ language 'plpgsql';
 
-CREATE TRIGGER update_url_analysis_updated_at BEFORE UPDATE ON url_analysis FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+-- url_analysis no usa trigger: upsert_url_analyses() fija updated_at directamente
 CREATE TRIGGER update_users_updated_at BEFORE UPDATE ON users FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 CREATE TRIGGER update_system_config_updated_at BEFORE UPDATE ON system_config FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
+-- Crea las particiones mensuales desde start_month hasta months_ahead meses después del actual.
+-- Si url_analysis_default ya tiene filas de un mes nuevo (la partición no
+-- existía cuando se insertaron), Postgres no deja crear la partición: se
+-- desvincula la partición por defecto, se crea la del mes, se mueven a ella
+-- esas filas y se vuelve a vincular, todo en la misma transacción.
+CREATE OR REPLACE FUNCTION ensure_url_analysis_partitions(months_ahead INTEGER DEFAULT 2, start_month DATE DEFAULT NULL)
+RETURNS INTEGER AS $$
+DECLARE
+    month_start DATE := date_trunc('month', COALESCE(start_month, NOW()::DATE));
+    last_month DATE := date_trunc('month', NOW() + make_interval(months => months_ahead));
+    month_end DATE;
+    partition_name TEXT;
+    stranded BOOLEAN;
+    created INTEGER := 0;
+BEGIN
+    WHILE month_start <= last_month LOOP
+        partition_name := format('url_analysis_p%s', to_char(month_start, 'YYYY_MM'));
+        IF to_regclass(partition_name) IS NULL THEN
+            month_end := (month_start + INTERVAL '1 month')::DATE;
+            stranded := EXISTS (
+                SELECT 1 FROM url_analysis_default WHERE created_at >= month_start AND created_at < month_end
+            );
+            IF stranded THEN
+                ALTER TABLE url_analysis DETACH PARTITION url_analysis_default;
+            END IF;
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF url_analysis FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, month_end
+            );
+            IF stranded THEN
+                WITH moved AS (
+                    DELETE FROM url_analysis_default
+                    WHERE created_at >= month_start AND created_at < month_end
+                    RETURNING *
+                )
+                INSERT INTO url_analysis SELECT * FROM moved;
+                ALTER TABLE url_analysis ATTACH PARTITION url_analysis_default DEFAULT;
+            END IF;
+            created := created + 1;
+        END IF;
+        month_start := (month_start + INTERVAL '1 month')::DATE;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_url_analysis_partitions();
+
+-- Upsert masivo por url_hash, común a upsert_url_analyses() (payload JSON) y
+-- upsert_url_analyses_from() (tabla de staging, sin pasar por JSONB).
+-- Devuelve (url_hash, id) de cada URL, tanto nuevas como existentes.
+-- updated_at se fija aquí, sin trigger BEFORE UPDATE.
+--
+-- - Las URLs nuevas reclaman su entrada en url_analysis_index con
+--   ON CONFLICT DO NOTHING; las existentes se leen del índice, así que
+--   reanalizar una URL no genera tuplas muertas en el índice.
+-- - Sólo se reescriben las filas cuyo veredicto cambió (processing_time no
+--   cuenta como cambio).
+-- - Si el índice apunta a una fila que ya no existe, la fila se vuelve a crear.
+-- - Las URLs que otra transacción insertó a la vez no son visibles en la foto
+--   de la sentencia: quedan con id NULL y se reintentan con una foto nueva.
+CREATE OR REPLACE FUNCTION upsert_url_analyses_core(payload JSONB, stage REGCLASS)
+RETURNS TABLE (url_hash VARCHAR, id UUID) AS $$
+DECLARE
+    source TEXT;
+    pending VARCHAR[];
+    missing VARCHAR[];
+    rec RECORD;
+    attempt INTEGER := 0;
+BEGIN
+    IF stage IS NULL THEN
+        source := 'jsonb_to_recordset($1) AS r(
+            url TEXT,
+            url_hash VARCHAR(64),
+            analysis_result JSONB,
+            risk_level VARCHAR(20),
+            prediction VARCHAR(20),
+            probability DECIMAL(3,2),
+            confidence VARCHAR(10),
+            features_extracted INTEGER,
+            processing_time DECIMAL(8,4),
+            threat_intelligence JSONB,
+            created_by VARCHAR(255),
+            created_at TIMESTAMPTZ
+        )';
+    ELSE
+        source := format('%s AS r', stage);
+    END IF;
+
+    LOOP
+        attempt := attempt + 1;
+        missing := '{}';
+        FOR rec IN EXECUTE format($sql$
+            WITH incoming AS (
+                SELECT DISTINCT ON (r.url_hash)
+                       r.url, r.url_hash, r.analysis_result, r.risk_level, r.prediction, r.probability,
+                       r.confidence, r.features_extracted, r.processing_time, r.threat_intelligence,
+                       r.created_by, COALESCE(r.created_at, NOW()) AS created_at
+                FROM %s
+                WHERE $2 IS NULL OR r.url_hash = ANY($2)
+            ),
+            claimed AS (
+                INSERT INTO url_analysis_index AS x (url_hash, created_at)
+                SELECT i.url_hash, i.created_at FROM incoming i
+                ON CONFLICT ON CONSTRAINT url_analysis_index_pkey DO NOTHING
+                RETURNING x.url_hash, x.id, x.created_at
+            ),
+            existing AS (
+                -- Foto del inicio de la sentencia: no incluye lo que inserta claimed.
+                -- Lleva los valores nuevos para que el UPDATE sólo cruce esta CTE con
+                -- url_analysis (sin estadísticas de las CTE, un cruce a tres elige mal el plan)
+                SELECT i.*, x.id, x.created_at AS row_created_at, (t.id IS NOT NULL) AS present,
+                       (t.url, t.analysis_result, t.risk_level, t.prediction, t.probability,
+                        t.confidence, t.features_extracted, t.threat_intelligence, t.created_by)
+                       IS DISTINCT FROM
+                       (i.url, i.analysis_result, i.risk_level, i.prediction, i.probability,
+                        i.confidence, i.features_extracted, i.threat_intelligence, i.created_by) AS changed
+                FROM incoming i
+                JOIN url_analysis_index x ON x.url_hash = i.url_hash
+                LEFT JOIN url_analysis t ON t.id = x.id AND t.created_at = x.created_at
+            ),
+            updated AS (
+                UPDATE url_analysis t SET
+                    url = e.url,
+                    analysis_result = e.analysis_result,
+                    risk_level = e.risk_level,
+                    prediction = e.prediction,
+                    probability = e.probability,
+                    confidence = e.confidence,
+                    features_extracted = e.features_extracted,
+                    processing_time = e.processing_time,
+                    threat_intelligence = e.threat_intelligence,
+                    created_by = e.created_by,
+                    updated_at = NOW()
+                FROM existing e
+                WHERE e.present AND e.changed AND t.id = e.id AND t.created_at = e.row_created_at
+                RETURNING t.id
+            ),
+            repointed AS (
+                -- Entrada del índice sin fila (p. ej. partición retirada): se recrea la fila
+                UPDATE url_analysis_index x SET created_at = e.created_at
+                FROM existing e
+                WHERE NOT e.present AND x.url_hash = e.url_hash
+                  AND x.id = e.id AND x.created_at = e.row_created_at
+                RETURNING x.url_hash, x.id, x.created_at
+            ),
+            inserted AS (
+                INSERT INTO url_analysis (
+                    id, url, url_hash, analysis_result, risk_level, prediction, probability,
+                    confidence, features_extracted, processing_time, threat_intelligence,
+                    created_by, created_at
+                )
+                SELECT n.id, i.url, i.url_hash, i.analysis_result, i.risk_level, i.prediction, i.probability,
+                       i.confidence, i.features_extracted, i.processing_time, i.threat_intelligence,
+                       i.created_by, n.created_at
+                FROM incoming i
+                JOIN (SELECT * FROM claimed UNION ALL SELECT * FROM repointed) n ON n.url_hash = i.url_hash
+                RETURNING url_analysis.id
+            ),
+            resolved AS (
+                SELECT c.url_hash, c.id FROM claimed c
+                UNION ALL
+                SELECT e.url_hash, e.id FROM existing e WHERE e.present
+                UNION ALL
+                SELECT p.url_hash, p.id FROM repointed p
+            )
+            SELECT r.url_hash, r.id FROM resolved r
+            UNION ALL
+            -- Sin resolver: se reintentan en la siguiente vuelta
+            SELECT i.url_hash, NULL FROM incoming i
+            WHERE NOT EXISTS (SELECT 1 FROM resolved r WHERE r.url_hash = i.url_hash)
+        $sql$, source) USING payload, pending
+        LOOP
+            IF rec.id IS NULL THEN
+                missing := missing || rec.url_hash;
+            ELSE
+                url_hash := rec.url_hash;
+                id := rec.id;
+                RETURN NEXT;
+            END IF;
+        END LOOP;
+
+        EXIT WHEN cardinality(missing) = 0;
+        IF attempt >= 3 THEN
+            RAISE EXCEPTION 'upsert_url_analyses: % URLs sin resolver tras % intentos', cardinality(missing), attempt;
+        END IF;
+        pending := missing;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- payload es un array JSON con las columnas de url_analysis (API)
+CREATE OR REPLACE FUNCTION upsert_url_analyses(payload JSONB)
+RETURNS TABLE (url_hash VARCHAR, id UUID) AS $$
+    SELECT * FROM upsert_url_analyses_core(payload, NULL);
+$$ LANGUAGE sql;
+
+-- stage es una tabla con las columnas de url_analysis, p. ej. la tabla
+-- temporal que llena bulk_scan.py con COPY
+CREATE OR REPLACE FUNCTION upsert_url_analyses_from(stage REGCLASS)
+RETURNS TABLE (url_hash VARCHAR, id UUID) AS $$
+    SELECT * FROM upsert_url_analyses_core(NULL, stage);
+$$ LANGUAGE sql;
+
 -- Inserción de datos iniciales
 INSERT INTO users (email, name, role) VALUES 
 ('admin@company.com', 'Administrador del Sistema', 'ADMIN'),
@@ -79,5 +305,6 @@ INSERT INTO system_config (config_key, config_value, description) VALUES
 ('phishing_threshold', '{"value": 0.85}'::JSONB, 'Umbral para clasificación de phishing'),
 ('suspicious_threshold', '{"value": 0.60}'::JSONB, 'Umbral para clasificación sospechosa'),
 ('rate_limit', '{"requests_per_minute": 60}'::JSONB, 'Límite de solicitudes por minuto'),
-('features_config', '{"enabled_features": ["url_length", "suspicious_keywords", "entropy", "redirects"]}'::JSONB, 'Características habilitadas para análisis')
+('features_config', '{"enabled_features": ["url_length", "suspicious_keywords", "entropy", "redirects"]}'::JSONB, 'Características habilitadas para análisis'),
+('suspicious_words', '{"words": ["login", "verify", "account", "bank", "paypal", "secure"]}'::JSONB, 'Léxico de palabras sospechosas')
 ON CONFLICT (config_key) DO NOTHING;